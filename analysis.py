@@ -0,0 +1,123 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from positions import format_number
+
+# Máximo de análisis de OpenAI en curso a la vez
+MAX_ANALYSIS_WORKERS = int(os.environ.get("MAX_ANALYSIS_WORKERS", 4))
+# Textos con los que se informa de un análisis fallido (no se deben memorizar)
+MISSING_KEY_MESSAGE = "Error: Falta la OpenAI API key."
+ANALYSIS_ERROR_PREFIX = "Error al generar el análisis:"
+
+def get_openai_api_key():
+    """
+    Obtiene la API key de OpenAI desde Streamlit secrets o
+    la pide al usuario en la barra lateral.
+    """
+    if "openai_api_key" in st.secrets:
+        return st.secrets["openai_api_key"]
+    api_key = st.sidebar.text_input("OpenAI API Key", type="password")
+    return api_key
+
+def _alternative_line(alt, trend=""):
+    line = f"- {alt['project']} en {alt['chain']}: {alt['symbol']} (APY: {alt['apy']:.2f}%, TVL: ${format_number(alt['tvlUsd'])})"
+    return f"{line}; evolución del APY: {trend}" if trend else line
+
+def stream_investment_analysis(current_position, alternatives, api_key):
+    """
+    Llama a la API de OpenAI para generar un análisis breve
+    comparando la posición actual vs. las alternativas.
+    Genera el texto por fragmentos a medida que llega (streaming).
+    """
+    if not api_key:
+        yield MISSING_KEY_MESSAGE
+        return
+
+    # Evolución del APY de cada alternativa según el histórico local (si lo hay)
+    from yield_history import describe_trend, get_pool_stats
+    trends = get_pool_stats(alt.get('pool') for alt in alternatives)
+
+    prompt = f"""
+    Eres un asesor DeFi experto.
+    Analiza brevemente esta posición y posibles alternativas:
+    Posición actual:
+    - Token: {current_position['token_symbol']}
+    - Protocolo: {current_position['common_name']}
+    - Balance USD: ${format_number(current_position['balance_usd'])}
+    Alternativas disponibles:
+    {chr(10).join([_alternative_line(alt, describe_trend(trends.get(alt.get('pool')))) for alt in alternatives])}
+    Da un comentario conciso (máx 100 palabras) y una recomendación final.
+    Si hay evolución del APY, ten en cuenta su estabilidad.
+    """
+
+    from llm_cache import stream_chat_completion
+
+    try:
+        yield from stream_chat_completion(
+            model="gpt-4o-mini",  # Ajusta según tu versión
+            messages=[
+                {"role": "system", "content": "Eres un asesor DeFi experto y muy conciso."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=300,
+            api_key=api_key
+        )
+    except Exception as e:
+        yield f"{ANALYSIS_ERROR_PREFIX} {e}"
+
+def is_analysis_error(text):
+    """True si el texto de un análisis terminó en error (falta de API key o fallo de OpenAI)."""
+    return text.startswith(MISSING_KEY_MESSAGE) or ANALYSIS_ERROR_PREFIX in text
+
+def generate_investment_analysis(current_position, alternatives, api_key):
+    """Igual que stream_investment_analysis, pero devuelve el texto completo."""
+    return "".join(stream_investment_analysis(current_position, alternatives, api_key))
+
+def generate_investment_analyses(jobs, api_key, max_workers=MAX_ANALYSIS_WORKERS):
+    """
+    Lanza los análisis en paralelo, con como mucho max_workers llamadas a
+    OpenAI simultáneas. jobs es {clave: (posición, alternativas)}.
+    Genera tuplas (clave, texto acumulado, terminado) a medida que llegan los
+    fragmentos de cada análisis, para pintarlos desde el hilo de Streamlit.
+    Si se deja de consumir el generador (p.ej. Streamlit relanza el script),
+    los análisis pendientes se cancelan y sus conexiones se cierran.
+    """
+    if not jobs:
+        return
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def run(key, position, alternatives):
+        stream = stream_investment_analysis(position, alternatives, api_key)
+        try:
+            for delta in stream:
+                if cancelled.is_set():
+                    break
+                events.put((key, delta))
+        except Exception as e:
+            events.put((key, f"{ANALYSIS_ERROR_PREFIX} {e}"))
+        finally:
+            stream.close()
+            events.put((key, None))
+
+    workers = max(1, min(max_workers, len(jobs)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="openai-analysis")
+    try:
+        for key, (position, alternatives) in jobs.items():
+            executor.submit(run, key, position, alternatives)
+        texts = {key: "" for key in jobs}
+        pending = len(jobs)
+        while pending:
+            key, delta = events.get()
+            if delta is None:
+                pending -= 1
+                yield key, texts[key], True
+            else:
+                texts[key] += delta
+                yield key, texts[key], False
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
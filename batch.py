@@ -0,0 +1,325 @@
+"""
+Ejecución por lotes (sin Streamlit) del análisis de portafolios:
+posiciones de Merlin, alternativas de DeFiLlama y resumen, para miles de wallets.
+
+    python batch.py wallets.csv --out resultados/ --processes 8
+
+Las wallets se reparten en bloques entre un pool de procesos; todos usan el
+mismo snapshot de DeFiLlama, fijado en <out>/snapshot y cargado con mmap. Cada
+bloque terminado se escribe como ficheros parciales y se anota en
+<out>/progress.jsonl, de modo que si el proceso se interrumpe, volver a lanzar
+el mismo comando continúa por donde se quedó.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import http_client
+from pool_store import PoolStore
+from positions import (
+    MAX_WALLET_WORKERS,
+    get_positions_for_wallets,
+    process_defi_data,
+    read_wallet_addresses,
+    summarize_portfolio,
+)
+from yields import ALTERNATIVE_FIELDS, LLAMA_SNAPSHOT_DIR, _fetch_defi_llama_yields, get_alternatives_for_portfolio
+
+# Wallets por bloque: unidad de reparto entre procesos y de checkpoint
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 50))
+# Alternativas por posición
+BATCH_ALTERNATIVES = int(os.environ.get("BATCH_ALTERNATIVES", 3))
+
+TABLES = ['wallets', 'positions', 'alternatives']
+
+try:
+    import pyarrow  # noqa: F401
+    DEFAULT_FORMAT = 'parquet'
+except ImportError:  # pyarrow es opcional: sin él se escribe CSV
+    DEFAULT_FORMAT = 'csv'
+
+
+########################################################################
+#                         SNAPSHOT COMPARTIDO                          #
+########################################################################
+
+def pin_yields_snapshot(out_dir, refresh=False):
+    """
+    Fija para toda la ejecución el snapshot de DeFiLlama en <out>/snapshot.
+    Al reanudar se reutiliza el ya fijado (resultados coherentes entre
+    ejecuciones) salvo con refresh. Si DeFiLlama no responde se usa el último
+    snapshot guardado por la app. Devuelve el directorio o un dict con 'error'.
+    """
+    snapshot_dir = os.path.join(out_dir, 'snapshot')
+    store = None if refresh else PoolStore.load(snapshot_dir)
+    if store is not None:
+        return snapshot_dir
+
+    result = _fetch_defi_llama_yields()
+    if 'error' not in result:
+        store = result['data']
+    else:
+        store = PoolStore.load(LLAMA_SNAPSHOT_DIR)
+        if store is None:
+            return {"error": f"No se pudo descargar DeFiLlama ni hay snapshot local: {result['error']}"}
+        print(f"DeFiLlama no responde; usando el snapshot local de {time.ctime(store.fetched_at)}", file=sys.stderr)
+    store.save(snapshot_dir)
+    return snapshot_dir
+
+
+########################################################################
+#                          TRABAJO POR BLOQUE                          #
+########################################################################
+
+# Estado de cada proceso del pool (se inicializa una vez por proceso)
+_worker = {}
+
+
+def _init_worker(snapshot_dir, merlin_api_key, threads):
+    # Conexiones propias: las del padre (descarga de DeFiLlama) no se comparten
+    http_client.reset_http_session()
+    store = PoolStore.load(snapshot_dir)
+    _worker['llama_data'] = {"status": "success", "data": store}
+    _worker['merlin_api_key'] = merlin_api_key
+    _worker['threads'] = threads
+
+
+def _write_table(df, path, fmt):
+    """Escribe un DataFrame de forma atómica (fichero temporal + rename)."""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    if fmt == 'parquet':
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def analyze_wallets(addresses, llama_data, merlin_api_key, threads=MAX_WALLET_WORKERS, n=BATCH_ALTERNATIVES):
+    """
+    Mismo pipeline que la página de Portfolio para una lista de direcciones.
+    Devuelve {'wallets', 'positions', 'alternatives'} como DataFrames.
+    """
+    wallet_dict = {addr: addr for addr in addresses}
+    results = get_positions_for_wallets(wallet_dict, merlin_api_key, max_workers=threads, force_refresh=True)
+
+    wallet_rows = []
+    frames = []
+    for addr in addresses:
+        result = results[addr]
+        row = {'wallet': addr, 'status': 'ok', 'error': None, 'positions': 0,
+               'balance_usd': 0.0, 'skipped': 0, 'summary': None}
+        if 'error' in result:
+            row.update(status='error', error=str(result['error']))
+        else:
+            df_wallet = process_defi_data(result)
+            row.update(positions=len(df_wallet), balance_usd=float(df_wallet['balance_usd'].sum()),
+                       skipped=df_wallet.attrs.get('skipped', 0), summary=summarize_portfolio(df_wallet))
+            if df_wallet.empty:
+                row['status'] = 'empty'
+            else:
+                df_wallet.insert(0, 'wallet', addr)
+                frames.append(df_wallet)
+        wallet_rows.append(row)
+
+    positions = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=['wallet', 'chain', 'common_name', 'module', 'token_symbol', 'balance_usd'])
+    positions.insert(1, 'position', positions.groupby('wallet', sort=False).cumcount() if len(positions) else [])
+
+    # Alternativas: cada símbolo distinto del bloque se resuelve una sola vez
+    alternative_rows = []
+    for idx, alternatives in get_alternatives_for_portfolio(positions, llama_data, n=n).items():
+        position = positions.loc[idx]
+        for rank, alternative in enumerate(alternatives, start=1):
+            alternative_rows.append({
+                'wallet': position['wallet'],
+                'position': position['position'],
+                'token_symbol': position['token_symbol'],
+                'rank': rank,
+                **{f"alt_{field}": alternative[field] for field in ALTERNATIVE_FIELDS},
+            })
+    alternatives = pd.DataFrame(alternative_rows, columns=[
+        'wallet', 'position', 'token_symbol', 'rank', *(f"alt_{field}" for field in ALTERNATIVE_FIELDS)])
+
+    return {'wallets': pd.DataFrame(wallet_rows), 'positions': positions, 'alternatives': alternatives}
+
+
+def _run_chunk(chunk_id, addresses, parts_dir, fmt):
+    """Procesa un bloque en un proceso del pool y escribe sus ficheros parciales."""
+    started = time.time()
+    tables = analyze_wallets(addresses, _worker['llama_data'], _worker['merlin_api_key'], _worker['threads'])
+    for name in TABLES:
+        _write_table(tables[name], os.path.join(parts_dir, f"{name}-{chunk_id:06d}.{fmt}"), fmt)
+    wallets = tables['wallets']
+    return {
+        'chunk': chunk_id,
+        'wallets': len(addresses),
+        'errors': int((wallets['status'] == 'error').sum()),
+        'positions': len(tables['positions']),
+        'seconds': round(time.time() - started, 3),
+    }
+
+
+########################################################################
+#                      CHECKPOINT Y EJECUCIÓN                          #
+########################################################################
+
+def _manifest(addresses, chunk_size, fmt):
+    digest = hashlib.sha256("\n".join(addresses).encode('utf-8')).hexdigest()
+    return {'wallets': len(addresses), 'wallets_sha256': digest, 'chunk_size': chunk_size, 'format': fmt}
+
+
+def _load_progress(out_dir, manifest):
+    """
+    Bloques ya terminados según <out>/progress.jsonl. Si el directorio es de
+    otra ejecución (otras wallets o parámetros) devuelve un dict con 'error'.
+    """
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            if json.load(f) != manifest:
+                return {"error": f"{out_dir} contiene otra ejecución; usa --restart o un directorio nuevo"}
+    else:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+    done = set()
+    progress_path = os.path.join(out_dir, 'progress.jsonl')
+    if os.path.exists(progress_path):
+        with open(progress_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['chunk'])
+                except (ValueError, KeyError):
+                    continue  # última línea a medias si se interrumpió al escribirla
+    return done
+
+
+def merge_parts(out_dir, fmt):
+    """Une los ficheros parciales en <out>/{wallets,positions,alternatives}.<fmt>."""
+    parts_dir = os.path.join(out_dir, 'parts')
+    read = pd.read_parquet if fmt == 'parquet' else pd.read_csv
+    paths = {}
+    for name in TABLES:
+        files = sorted(f for f in os.listdir(parts_dir) if f.startswith(f"{name}-") and f.endswith(f".{fmt}"))
+        frames = [read(os.path.join(parts_dir, f)) for f in files]
+        frames = [frame for frame in frames if len(frame)] or frames[:1]
+        paths[name] = os.path.join(out_dir, f"{name}.{fmt}")
+        _write_table(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(), paths[name], fmt)
+    return paths
+
+
+def run_batch(addresses, out_dir, merlin_api_key, processes=None, threads=MAX_WALLET_WORKERS,
+              chunk_size=BATCH_CHUNK_SIZE, fmt=DEFAULT_FORMAT, refresh_yields=False, restart=False):
+    """
+    Analiza todas las direcciones en un pool de procesos con checkpoint por
+    bloque. Devuelve un dict con las estadísticas de la ejecución, o con 'error'.
+    """
+    addresses = list(dict.fromkeys(addresses))
+    parts_dir = os.path.join(out_dir, 'parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    if restart:
+        for name in ('manifest.json', 'progress.jsonl'):
+            if os.path.exists(os.path.join(out_dir, name)):
+                os.remove(os.path.join(out_dir, name))
+        for name in os.listdir(parts_dir):
+            os.remove(os.path.join(parts_dir, name))
+
+    done = _load_progress(out_dir, _manifest(addresses, chunk_size, fmt))
+    if isinstance(done, dict):
+        return done
+    snapshot_dir = pin_yields_snapshot(out_dir, refresh=refresh_yields)
+    if isinstance(snapshot_dir, dict):
+        return snapshot_dir
+    # No dejar conexiones abiertas que heredarían los procesos del pool
+    http_client.http_session.close()
+
+    chunks = [addresses[i:i + chunk_size] for i in range(0, len(addresses), chunk_size)]
+    pending = [chunk_id for chunk_id in range(len(chunks)) if chunk_id not in done]
+    total = len(addresses)
+    completed = sum(len(chunks[chunk_id]) for chunk_id in done)
+    if done:
+        print(f"Reanudando: {len(done)}/{len(chunks)} bloques ya terminados", file=sys.stderr)
+
+    started = time.time()
+    processed = 0
+    errors = 0
+    progress_path = os.path.join(out_dir, 'progress.jsonl')
+    if pending:
+        workers = max(1, min(processes or os.cpu_count() or 1, len(pending)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(snapshot_dir, merlin_api_key, threads)) as executor:
+            futures = [executor.submit(_run_chunk, chunk_id, chunks[chunk_id], parts_dir, fmt) for chunk_id in pending]
+            with open(progress_path, 'a', encoding='utf-8') as progress:
+                for future in as_completed(futures):
+                    stats = future.result()
+                    progress.write(json.dumps(stats) + "\n")
+                    progress.flush()
+                    processed += stats['wallets']
+                    errors += stats['errors']
+                    completed += stats['wallets']
+                    elapsed = time.time() - started
+                    rate = processed / elapsed if elapsed > 0 else 0.0
+                    eta = (total - completed) / rate if rate else float('inf')
+                    print(f"[{completed}/{total}] {rate:.1f} wallets/s, {errors} errores, ETA {eta:.0f}s", file=sys.stderr)
+
+    paths = merge_parts(out_dir, fmt)
+    elapsed = time.time() - started
+    return {
+        'wallets': total,
+        'processed': processed,
+        'resumed': total - processed,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'wallets_per_second': round(processed / elapsed, 2) if elapsed > 0 else None,
+        'outputs': paths,
+    }
+
+
+def get_merlin_api_key():
+    """API key de Merlin desde MERLIN_API_KEY o, si existe, .streamlit/secrets.toml."""
+    api_key = os.environ.get("MERLIN_API_KEY")
+    if api_key:
+        return api_key
+    try:
+        import streamlit as st
+        return st.secrets["merlin_api_key"]
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análisis por lotes de portafolios DeFi")
+    parser.add_argument("wallets", help="CSV/TXT con direcciones ('-' para stdin)")
+    parser.add_argument("--out", required=True, help="Directorio de resultados y checkpoint")
+    parser.add_argument("--format", choices=['parquet', 'csv'], default=DEFAULT_FORMAT)
+    parser.add_argument("--processes", type=int, default=None, help="Procesos del pool (por defecto, núcleos)")
+    parser.add_argument("--threads", type=int, default=MAX_WALLET_WORKERS, help="Consultas a Merlin en paralelo por proceso")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--refresh-yields", action="store_true", help="Descargar un snapshot nuevo de DeFiLlama al reanudar")
+    parser.add_argument("--restart", action="store_true", help="Descartar el progreso anterior del directorio")
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and DEFAULT_FORMAT != 'parquet':
+        parser.error("--format parquet requiere pyarrow")
+    merlin_api_key = get_merlin_api_key()
+    if not merlin_api_key:
+        parser.error("Falta la API key de Merlin (MERLIN_API_KEY o .streamlit/secrets.toml)")
+
+    addresses = read_wallet_addresses(sys.stdin if args.wallets == '-' else args.wallets)
+    if not addresses:
+        parser.error("No se encontraron direcciones en la entrada")
+
+    stats = run_batch(addresses, args.out, merlin_api_key, processes=args.processes, threads=args.threads,
+                      chunk_size=args.chunk_size, fmt=args.format,
+                      refresh_yields=args.refresh_yields, restart=args.restart)
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+    return 1 if 'error' in stats else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,464 @@
+"""
+Benchmarks de los caminos críticos con datos sintéticos de Merlin y DeFiLlama.
+
+    python benchmark.py --pools 10,1000,100000 --positions 1,100,5000 --out bench.json
+    python benchmark.py --quick --compare bench.json
+
+Para cada caso se mide el tiempo (mínimo, mediana y media de varias
+repeticiones), el rendimiento (elementos/s) y el pico de memoria (tracemalloc).
+Los resultados se guardan en JSON y --compare muestra la variación frente a una
+ejecución anterior.
+"""
+import argparse
+import ast
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pool_filters import run_filter_pipeline
+from pool_store import POOL_FIELDS, PoolStore
+from portfolio_aggregates import compute_dashboard
+from positions import process_defi_data, summarize_portfolio
+from yields import get_alternatives_for_token
+
+DEFAULT_POOLS = [10, 1000, 100000]
+DEFAULT_POSITIONS = [1, 100, 5000]
+QUICK_POOLS = [1000]
+QUICK_POSITIONS = [100]
+# Páginas de la app cuyo tiempo de importación mide --startup
+PAGES = ['home.py', os.path.join('pages', '1_portfolio.py'), os.path.join('pages', '2_oportunities.py')]
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Variación (en tanto por uno) a partir de la cual --compare marca una regresión
+REGRESSION_THRESHOLD = 0.10
+
+
+########################################################################
+#                         DATOS SINTÉTICOS                             #
+########################################################################
+
+CHAINS = ['Ethereum', 'Arbitrum', 'Avalanche', 'Polygon', 'BSC', 'Optimism', 'Mantle', 'Base', 'Solana', 'Linea']
+MAJOR_TOKENS = ['USDC', 'USDT', 'DAI', 'ETH', 'WETH', 'WSTETH', 'STETH', 'WBTC', 'USDC.E', 'AXLUSDC',
+                'ARB', 'OP', 'AVAX', 'MATIC', 'CMETH', 'PT-CMETH', 'GHO', 'FRAX', 'CRV', 'AAVE']
+MERLIN_MODULES = ['Lending', 'Yield', 'Staking', 'Farming', 'Liquidity Pool']
+
+
+def _token_universe(n_pools):
+    # Los pools grandes tienen una cola larga de tokens poco frecuentes
+    long_tail = [f"TKN{i}" for i in range(max(10, n_pools // 20))]
+    return MAJOR_TOKENS, long_tail
+
+
+def _pick_token(rng, major, long_tail):
+    return rng.choice(major) if rng.random() < 0.6 else rng.choice(long_tail)
+
+
+def synthetic_llama_pools(n_pools, seed=0):
+    """
+    Respuesta de /pools de DeFiLlama con n_pools pools, con los mismos campos
+    que la API real (incluidos los que la app no usa) y distribuciones de APY y
+    TVL sesgadas como las reales.
+    """
+    rng = random.Random(seed)
+    major, long_tail = _token_universe(n_pools)
+    projects = [f"protocol-{i}" for i in range(max(5, n_pools // 100))] + ['aave-v3', 'pendle', 'curve-dex', 'uniswap-v3']
+    pools = []
+    for i in range(n_pools):
+        single = rng.random() < 0.55
+        tokens = [_pick_token(rng, major, long_tail) for _ in range(1 if single else rng.choice([2, 2, 3]))]
+        apy_base = rng.lognormvariate(1.0, 1.2)
+        apy_reward = rng.lognormvariate(0.5, 1.5) if rng.random() < 0.3 else None
+        apy = None if rng.random() < 0.01 else apy_base + (apy_reward or 0)
+        pools.append({
+            'chain': rng.choice(CHAINS),
+            'project': rng.choice(projects),
+            'symbol': '-'.join(tokens),
+            'tvlUsd': rng.lognormvariate(12, 2.5),
+            'apyBase': apy_base,
+            'apyReward': apy_reward,
+            'apy': apy,
+            'rewardTokens': [f"0x{rng.getrandbits(160):040x}"] if apy_reward else None,
+            'pool': f"{rng.getrandbits(128):032x}",
+            'apyPct1D': rng.uniform(-1, 1),
+            'apyPct7D': rng.uniform(-3, 3),
+            'apyPct30D': rng.uniform(-5, 5),
+            'stablecoin': all(t in ('USDC', 'USDT', 'DAI', 'GHO', 'FRAX') for t in tokens),
+            'ilRisk': 'no' if single else 'yes',
+            'exposure': 'single' if single else 'multi',
+            'predictions': {'predictedClass': 'Stable/Up', 'predictedProbability': rng.randint(50, 100), 'binnedConfidence': 2},
+            'poolMeta': None,
+            'mu': rng.uniform(0, 20),
+            'sigma': rng.uniform(0, 2),
+            'count': rng.randint(1, 1000),
+            'outlier': False,
+            'underlyingTokens': [f"0x{rng.getrandbits(160):040x}" for _ in tokens],
+            'il7d': None,
+            'apyBase7d': None,
+            'apyMean30d': apy_base,
+            'volumeUsd1d': None,
+            'volumeUsd7d': None,
+            'apyBaseInception': None,
+        })
+    return {'status': 'success', 'data': pools}
+
+
+def _merlin_token(rng, symbol, balance):
+    return {
+        'tokenSymbol': symbol,
+        'tokenAddress': f"0x{rng.getrandbits(160):040x}",
+        'balance': balance / max(rng.uniform(0.5, 4000), 1e-9),
+        'balanceUSD': balance,
+        'price': rng.uniform(0.5, 4000),
+    }
+
+
+def synthetic_merlin_positions(n_positions, seed=0):
+    """
+    Respuesta de userDeFiPositions de Merlin con unas n_positions posiciones
+    repartidas en protocolos y módulos. Incluye posiciones por debajo de
+    MIN_POSITION_USD y alguna entrada mal formada, como en las respuestas reales.
+    """
+    rng = random.Random(seed)
+    major, long_tail = _token_universe(1000)
+    protocols = []
+    remaining = n_positions
+    while remaining > 0:
+        portfolio = []
+        for _ in range(rng.randint(1, 4)):
+            if remaining <= 0:
+                break
+            module = rng.choice(MERLIN_MODULES)
+            if module == 'Liquidity Pool':
+                supply = [_merlin_token(rng, _pick_token(rng, major, long_tail), rng.lognormvariate(5, 2)) for _ in range(2)]
+                remaining -= 1
+            else:
+                count = min(remaining, rng.randint(1, 3))
+                supply = [_merlin_token(rng, _pick_token(rng, major, long_tail), rng.lognormvariate(5, 2)) for _ in range(count)]
+                remaining -= count
+            if rng.random() < 0.01:
+                supply.append("malformed")
+            portfolio.append({'module': module, 'detailed': {'supply': supply, 'borrow': [], 'rewards': []}})
+        protocols.append({
+            'chain': rng.choice(CHAINS).lower(),
+            'commonName': f"Protocol {rng.randint(0, 200)}",
+            'logo': None,
+            'portfolio': portfolio,
+        })
+    return protocols
+
+
+def synthetic_portfolio(n_positions, seed=0):
+    """DataFrame combinado (como combined_df) con n_positions posiciones en varias wallets."""
+    df = process_defi_data(synthetic_merlin_positions(n_positions, seed))
+    df['wallet'] = [f"Wallet #{i % 10 + 1}" for i in range(len(df))]
+    return df
+
+
+########################################################################
+#                              MEDICIÓN                                #
+########################################################################
+
+def measure(fn, repeat=5, items=1, warmup=1):
+    """
+    Ejecuta fn() `repeat` veces y devuelve tiempos, rendimiento (items/s) y el
+    pico de memoria de una ejecución adicional bajo tracemalloc.
+    """
+    for _ in range(warmup):
+        fn()
+    gc.collect()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(times)
+    return {
+        'repeat': repeat,
+        'min_s': min(times),
+        'median_s': median,
+        'mean_s': statistics.fmean(times),
+        'throughput': items / median if median > 0 else None,
+        'peak_mem_bytes': peak,
+    }
+
+
+FILTER_CONTEXTS = [
+    {'chain': 'arbitrum'},
+    {'token': 'USDC'},
+    {'chain': 'ethereum', 'token': 'ETH', 'min_tvl': 1e6},
+    {'token': 'WSTETH-STETH', 'type': 'Liquidity Pool', 'min_apy': 5},
+    {'protocol': 'aave', 'type': 'Yield', 'min_tvl': 1e5, 'min_apy': 2},
+]
+
+
+def _filter_query(store, context):
+    # Igual que filter_defi_llama_data (pages/2_oportunities.py) sin session_state
+    rows, filters_applied, _, _ = run_filter_pipeline(store, context)
+    return store.records(store.top_by_apy(rows, 10)), filters_applied
+
+
+def bench_pools(n_pools, repeat):
+    """Casos que dependen del tamaño del universo de pools."""
+    llama_data = synthetic_llama_pools(n_pools, seed=n_pools)
+    raw = json.dumps(llama_data).encode('utf-8')
+    store = PoolStore.from_llama(llama_data)
+    symbols = ['USDC', 'ETH', 'WBTC', 'WSTETH-STETH', 'CMETH/PT-CMETH', 'TKN3', 'ARB', 'DAI']
+    results = []
+
+    def chunks():
+        for i in range(0, len(raw), 64 * 1024):
+            yield raw[i:i + 64 * 1024]
+
+    results.append(('load_yields_stream', n_pools, None, 'pools',
+                    measure(lambda: PoolStore.from_stream(chunks()), repeat, items=n_pools)))
+
+    # Con un store nuevo en cada ejecución: sin memorias de top-n por token
+    def alternatives_cold():
+        cold = {'status': 'success', 'data': PoolStore.from_columns({col: store.column(col) for col in POOL_FIELDS})}
+        for symbol in symbols:
+            get_alternatives_for_token(symbol, cold)
+
+    warm_data = {'status': 'success', 'data': store}
+    results.append(('get_alternatives_for_token_cold', n_pools, None, 'queries',
+                    measure(alternatives_cold, repeat, items=len(symbols))))
+    results.append(('get_alternatives_for_token', n_pools, None, 'queries',
+                    measure(lambda: [get_alternatives_for_token(s, warm_data) for s in symbols], repeat, items=len(symbols))))
+    results.append(('get_alternatives_for_token_scoped', n_pools, None, 'queries',
+                    measure(lambda: [get_alternatives_for_token(s, warm_data, chain='Arbitrum', protocol='aave')
+                                     for s in symbols], repeat, items=len(symbols))))
+
+    # Sin caché de prefijos (store recién creado) y con ella (consultas repetidas)
+    def filters_cold():
+        fresh = PoolStore(store.apy, store.tvl, store.codes, store.categories, fetched_at=store.fetched_at)
+        for context in FILTER_CONTEXTS:
+            _filter_query(fresh, context)
+
+    results.append(('filter_defi_llama_data_cold', n_pools, None, 'queries',
+                    measure(filters_cold, repeat, items=len(FILTER_CONTEXTS))))
+    results.append(('filter_defi_llama_data', n_pools, None, 'queries',
+                    measure(lambda: [_filter_query(store, c) for c in FILTER_CONTEXTS], repeat, items=len(FILTER_CONTEXTS))))
+    return results
+
+
+def bench_positions(n_positions, repeat):
+    """Casos que dependen del tamaño del portafolio."""
+    payload = synthetic_merlin_positions(n_positions, seed=n_positions)
+    df = synthetic_portfolio(n_positions, seed=n_positions)
+    return [
+        ('process_defi_data', None, n_positions, 'positions',
+         measure(lambda: process_defi_data(payload), repeat, items=n_positions)),
+        ('summarize_portfolio', None, n_positions, 'positions',
+         measure(lambda: summarize_portfolio(df), repeat, items=len(df))),
+        ('dashboard_aggregates', None, n_positions, 'positions',
+         measure(lambda: compute_dashboard(df), repeat, items=len(df))),
+    ]
+
+
+########################################################################
+#                        ARRANQUE DE PÁGINAS                           #
+########################################################################
+
+# Se ejecuta en un intérprete nuevo: Streamlit ya está cargado cuando se
+# ejecuta una página, así que se mide lo que la página importa además de él
+_STARTUP_PROBE = """
+import json, sys, time
+import streamlit
+sys.stderr.write("--page-imports--\\n")
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": len(sys.modules)}}))
+"""
+
+
+def _page_imports(path):
+    """Sentencias import de nivel superior de una página."""
+    with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def _heaviest_imports(importtime_log, top=5):
+    """Módulos de primer nivel con mayor tiempo acumulado según -X importtime."""
+    lines = importtime_log.split("--page-imports--", 1)[-1].splitlines()
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith(" ") or name.startswith("  ") or not cumulative.strip().isdigit():
+            continue  # sólo módulos importados directamente (sin sangría)
+        modules.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda m: -m[1])[:top]
+
+
+def bench_startup(pages=PAGES, repeat=5):
+    """
+    Tiempo de importación de cada página en un proceso nuevo (arranque en frío
+    de un worker), medido sobre Streamlit ya cargado.
+    """
+    results = []
+    for page in pages:
+        code = _STARTUP_PROBE.format(imports=_page_imports(page))
+        times = []
+        modules = None
+        heaviest = []
+        for i in range(repeat):
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                                  capture_output=True, text=True, timeout=300)
+            if proc.returncode != 0:
+                raise RuntimeError(f"No se pudo importar {page}:\n{proc.stderr[-2000:]}")
+            probe = json.loads(proc.stdout.strip().splitlines()[-1])
+            times.append(probe['seconds'])
+            modules = probe['modules']
+            if i == 0:
+                heaviest = _heaviest_imports(proc.stderr)
+        median = statistics.median(times)
+        results.append(('startup_import', page, {
+            'repeat': repeat,
+            'min_s': min(times),
+            'median_s': median,
+            'mean_s': statistics.fmean(times),
+            'modules': modules,
+            'heaviest': heaviest,
+        }))
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(pool_sizes=DEFAULT_POOLS, position_sizes=DEFAULT_POSITIONS, repeat=5, progress=None, startup=True):
+    """Ejecuta todos los casos y devuelve el informe (dict serializable a JSON)."""
+    results = []
+    if startup:
+        for case, page, stats in bench_startup(repeat=repeat):
+            result = {'case': case, 'page': page, 'pools': None, 'positions': None, 'unit': None, **stats}
+            results.append(result)
+            if progress:
+                progress(result)
+    jobs = [(bench_pools, n) for n in pool_sizes] + [(bench_positions, n) for n in position_sizes]
+    for bench, size in jobs:
+        for case, pools, positions, unit, stats in bench(size, repeat):
+            result = {'case': case, 'pools': pools, 'positions': positions, 'unit': unit, **stats}
+            results.append(result)
+            if progress:
+                progress(result)
+    return {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def _result_key(result):
+    return result['case'], result.get('page'), result['pools'], result['positions']
+
+
+def _size_label(result):
+    if result.get('page'):
+        return f"page={result['page']}"
+    if result['pools'] is not None:
+        return f"pools={result['pools']}"
+    return f"positions={result['positions']}"
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Variación de la mediana de cada caso frente a otro informe.
+    Devuelve [(resultado, base_s, actual_s, variación, regresión)].
+    """
+    previous = {_result_key(r): r for r in baseline.get('results', [])}
+    rows = []
+    for result in report['results']:
+        base = previous.get(_result_key(result))
+        if base is None or not base['median_s']:
+            continue
+        change = result['median_s'] / base['median_s'] - 1
+        rows.append((result, base['median_s'], result['median_s'], change, change > threshold))
+    return rows
+
+
+def _format_result(result):
+    if result['case'] == 'startup_import':
+        heaviest = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in result['heaviest'])
+        return (f"{result['case']:<34} {_size_label(result):<36} median {result['median_s'] * 1000:9.1f} ms  "
+                f"{result['modules']} módulos  ({heaviest})")
+    throughput = f"{result['throughput']:,.0f} {result['unit']}/s" if result['throughput'] else "-"
+    return (f"{result['case']:<34} {_size_label(result):<16} median {result['median_s'] * 1000:9.3f} ms  "
+            f"{throughput:>22}  peak {result['peak_mem_bytes'] / 2**20:8.2f} MiB")
+
+
+def _sizes(text):
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de los caminos críticos con datos sintéticos")
+    parser.add_argument("--pools", type=_sizes, default=None, help="Tamaños del universo de pools (p.ej. 10,1000,100000)")
+    parser.add_argument("--positions", type=_sizes, default=None, help="Tamaños del portafolio (p.ej. 1,100,5000)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Sólo tamaños pequeños (comprobación rápida)")
+    parser.add_argument("--startup", action="store_true", help="Sólo el tiempo de importación de cada página")
+    parser.add_argument("--no-startup", action="store_true", help="Omitir el tiempo de importación de las páginas")
+    parser.add_argument("--out", help="Guardar el informe en este fichero JSON")
+    parser.add_argument("--compare", help="Informe JSON anterior con el que comparar")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Variación de la mediana que se considera regresión (0.10 = +10%%)")
+    args = parser.parse_args(argv)
+
+    pool_sizes = args.pools or (QUICK_POOLS if args.quick else DEFAULT_POOLS)
+    position_sizes = args.positions or (QUICK_POSITIONS if args.quick else DEFAULT_POSITIONS)
+    if args.startup:
+        pool_sizes, position_sizes = [], []
+    report = run_benchmarks(pool_sizes, position_sizes, args.repeat, progress=lambda r: print(_format_result(r)),
+                            startup=not args.no_startup)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Informe guardado en {args.out}")
+
+    regressions = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nComparación con {args.compare} (revisión {baseline.get('meta', {}).get('revision')}):")
+        for result, base_s, current_s, change, regression in compare(report, baseline, args.threshold):
+            flag = "  <-- REGRESIÓN" if regression else ""
+            print(f"{result['case']:<34} {_size_label(result):<16} {base_s * 1000:9.3f} ms -> "
+                  f"{current_s * 1000:9.3f} ms ({change:+.1%}){flag}")
+            regressions += regression
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
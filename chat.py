@@ -0,0 +1,212 @@
+import streamlit as st
+
+def init_chat_history():
+    """Inicializa (o recupera) el historial de chat en session_state."""
+    if "messages" not in st.session_state:
+        st.session_state["messages"] = [
+            {"role": "assistant", "content": "¡Hola! Soy tu asistente DeFi. Pregúntame sobre tu portafolio o alternativas de inversión."}
+        ]
+
+def render_chat():
+    if "combined_df" not in st.session_state or st.session_state["combined_df"] is None:
+        st.warning("Por favor, primero analiza tu portafolio en la página de Portfolio.")
+        return
+        
+    if st.session_state['combined_df'] is None:
+        st.warning("Por favor, primero analiza tu portafolio en la página de Portfolio.")
+        return
+    """Muestra el historial de chat y maneja las interacciones."""
+    for msg in st.session_state["messages"]:
+        st.chat_message(msg["role"]).write(msg["content"])
+
+    user_input = st.chat_input("Escribe tu pregunta o solicitud aquí...")
+    if user_input:
+        # La búsqueda de alternativas y OpenAI se cargan con el primer mensaje,
+        # no al abrir la página
+        from analysis import generate_investment_analysis, get_openai_api_key
+        from chat_context import SUMMARY_PROMPT, ChatContext
+        from chat_intents import ALTERNATIVES_KEYWORDS, POSITION_KEYWORDS, parse_alternatives_request
+        from llm_cache import cached_chat_completion
+        from positions import format_number, get_portfolio_summary
+        from yield_history import annotate_with_trends
+        from yields import get_alternatives_for_token, get_defi_llama_yields, get_pool_store
+
+        st.session_state["messages"].append({"role": "user", "content": user_input})
+        st.chat_message("user").write(user_input)
+
+        reply_stream = None
+        openai_api_key = get_openai_api_key()
+        if not openai_api_key:
+            ai_response = "Por favor, agrega tu OpenAI API key para continuar."
+        else:
+            # Verificar si el usuario está pidiendo alternativas
+            if any(keyword in user_input.lower() for keyword in ALTERNATIVES_KEYWORDS):
+                try:
+                    token = None
+                    current_position = None
+
+                    # Extracción local de posición/token/blockchain/protocolo; sólo se
+                    # consulta al LLM si el análisis local es ambiguo
+                    llama_data = get_defi_llama_yields()
+                    store = get_pool_store(llama_data) if 'error' not in llama_data else None
+                    intent = parse_alternatives_request(
+                        user_input, store, st.session_state["combined_df"]['token_symbol'].unique()
+                    )
+
+                    # Si menciona una posición específica
+                    if any(word in user_input.lower() for word in POSITION_KEYWORDS):
+                        # Extraer el número de posición
+                        position_num = intent['position']
+                        if position_num is None:
+                            completion = cached_chat_completion(
+                                model="gpt-3.5-turbo",
+                                messages=[
+                                    {"role": "system", "content": "Extrae el número de la posición mencionada en el mensaje. Responde solo con el número."},
+                                    {"role": "user", "content": user_input}
+                                ],
+                                api_key=openai_api_key
+                            )
+                            position_num = completion["choices"][0]["message"]["content"].strip()
+
+                        # Obtener el DataFrame del estado de la sesión
+                        if "combined_df" in st.session_state:
+                            df = st.session_state["combined_df"]
+                            try:
+                                position_idx = int(position_num) - 1
+                                if 0 <= position_idx < len(df):
+                                    current_position = df.iloc[position_idx].to_dict()
+                                    token = current_position['token_symbol']
+
+                                    # Mostrar la posición actual
+                                    st.info(f"Posición actual:\n"
+                                           f"Token: {token}\n"
+                                           f"Protocolo: {current_position['common_name']}\n"
+                                           f"Balance: ${format_number(current_position['balance_usd'])}\n"
+                                           f"Wallet: {current_position['wallet']}")
+                                else:
+                                    ai_response = f"No encontré la posición {position_num} en tu portafolio."
+                                    raise ValueError("Posición fuera de rango")
+                            except:
+                                ai_response = "Por favor, especifica un número de posición válido."
+                                raise ValueError("Número de posición inválido")
+                        else:
+                            ai_response = "No encuentro tu portafolio. ¿Has analizado tus wallets primero?"
+                            raise ValueError("No hay portafolio")
+                    else:
+                        # Si solo menciona un token
+                        token = intent['token']
+                        if token is None:
+                            completion = cached_chat_completion(
+                                model="gpt-4o-mini",
+                                messages=[
+                                    {"role": "system", "content": "Extrae solo el símbolo del token mencionado en el mensaje. Responde únicamente con el símbolo."},
+                                    {"role": "user", "content": user_input}
+                                ],
+                                api_key=openai_api_key
+                            )
+                            token = completion["choices"][0]["message"]["content"].strip()
+
+                    if token:
+                        # Obtener alternativas de DeFi Llama
+                        if 'error' not in llama_data:
+                            # Filtrar alternativas por el token de la posición seleccionada
+                            # (y por blockchain/protocolo si el usuario los menciona)
+                            alternatives = get_alternatives_for_token(
+                                token, llama_data, chain=intent['chain'], protocol=intent['protocol']
+                            )
+
+                            if alternatives:
+                                if current_position:
+                                    # Si tenemos la posición actual, usar generate_investment_analysis
+                                    analysis = generate_investment_analysis(current_position, alternatives, openai_api_key)
+                                    response_parts = [f"🔍 Análisis y alternativas para tu posición en {token}:\n\n{analysis}\n\n📊 Detalles de las alternativas:\n"]
+                                else:
+                                    response_parts = [f"📊 Mejores alternativas para {token}:\n"]
+
+                                for alt in annotate_with_trends(alternatives):
+                                    response_parts.append(
+                                        f"• {alt['project']} en {alt['chain']}:\n"
+                                        f"  - Pool: {alt['symbol']}\n"
+                                        f"  - APY: {alt['apy']:.2f}%\n"
+                                        f"  - TVL: ${format_number(alt['tvlUsd'])}\n"
+                                        + (f"  - Evolución APY: {alt['apy_trend']}\n" if alt['apy_trend'] else "")
+                                    )
+                                ai_response = "\n".join(response_parts)
+                            else:
+                                ai_response = f"No encontré alternativas para {token}. ¿Podrías verificar el símbolo del token?"
+                        else:
+                            ai_response = "Lo siento, no pude consultar las alternativas en este momento. Por favor, inténtalo más tarde."
+
+                except Exception as e:
+                    if not 'ai_response' in locals():
+                        ai_response = f"Lo siento, hubo un error al procesar tu solicitud: {str(e)}"
+            else:
+                # Comportamiento normal del chat: ventana de turnos recientes más un
+                # resumen de los antiguos, con el portafolio comprimido, todo dentro
+                # del presupuesto de tokens
+                def summarize_conversation(previous, transcript):
+                    completion = cached_chat_completion(
+                        model="gpt-3.5-turbo",
+                        messages=[
+                            {"role": "system", "content": SUMMARY_PROMPT},
+                            {"role": "user", "content": f"Resumen previo:\n{previous or '(ninguno)'}\n\nNuevos mensajes:\n{transcript}"}
+                        ],
+                        temperature=0,
+                        api_key=openai_api_key
+                    )
+                    return completion["choices"][0]["message"]["content"]
+
+                combined_df = st.session_state["combined_df"]
+                chat_context = ChatContext(st.session_state.setdefault("chat_context", {}), summarize_conversation)
+                messages_for_openai = chat_context.build(
+                    st.session_state["messages"],
+                    lambda top_k: get_portfolio_summary(combined_df, top_k=top_k)
+                )
+
+                reply_stream = _stream_chat_reply(messages_for_openai, openai_api_key)
+
+        if reply_stream is not None:
+            _write_streamed_reply(reply_stream)
+            return
+
+        st.session_state["messages"].append({"role": "assistant", "content": ai_response})
+        st.chat_message("assistant").write(ai_response)
+
+def _stream_chat_reply(messages_for_openai, api_key):
+    """Respuesta del chat general en streaming (sin caché: cada conversación es distinta)."""
+    from llm_cache import stream_chat_completion
+
+    try:
+        yield from stream_chat_completion(
+            cache=False,
+            model="gpt-3.5-turbo",
+            messages=messages_for_openai,
+            api_key=api_key
+        )
+    except Exception as e:
+        yield f"Error al generar respuesta: {e}"
+
+def _write_streamed_reply(reply_stream):
+    """
+    Pinta la respuesta token a token en el chat y la guarda en el historial.
+    Si el usuario envía otro mensaje a mitad, Streamlit interrumpe esta
+    ejecución: se cierra la conexión con OpenAI y se guarda lo recibido.
+    """
+    parts = []
+    completed = False
+
+    def collect():
+        for delta in reply_stream:
+            parts.append(delta)
+            yield delta
+
+    try:
+        with st.chat_message("assistant"):
+            st.write_stream(collect())
+        completed = True
+    finally:
+        reply_stream.close()
+        content = "".join(parts)
+        if not completed:
+            content += " …(respuesta interrumpida)"
+        st.session_state["messages"].append({"role": "assistant", "content": content})
@@ -0,0 +1,139 @@
+import os
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken es opcional: sin él se estima ~4 caracteres por token
+    tiktoken = None
+
+# Presupuesto máximo de tokens del prompt del chat general
+CHAT_TOKEN_BUDGET = int(os.environ.get("CHAT_TOKEN_BUDGET", 3000))
+# Reparto del presupuesto: resumen del portafolio y resumen de la conversación
+PORTFOLIO_SHARE = 0.35
+SUMMARY_SHARE = 0.15
+# Posiciones detalladas a probar en el resumen del portafolio, de más a menos
+PORTFOLIO_TOP_K_STEPS = (50, 20, 10, 5, 0)
+
+SYSTEM_PROMPT = (
+    "Actúa como un asesor experto en DeFi. "
+    "A continuación tienes un resumen del portafolio del usuario. Úsalo para responder de forma contextual.\n\n"
+)
+SUMMARY_PROMPT = (
+    "Resume de forma muy concisa (máx 120 palabras) la conversación entre un usuario y su asesor DeFi, "
+    "conservando preguntas, decisiones, tokens y cifras relevantes. Integra el resumen previo si existe."
+)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Número (aproximado si no hay tiktoken) de tokens de un texto."""
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(message):
+    # ~4 tokens de formato por mensaje en la API de chat
+    return count_tokens(message.get("content", "")) + 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Recorta un texto para que no supere max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if tiktoken is not None:
+        return _encoding.decode(_encoding.encode(text)[:max_tokens]) + "…"
+    return text[:max_tokens * 4] + "…"
+
+
+def fit_portfolio_summary(summarize, max_tokens):
+    """
+    Resumen del portafolio que cabe en max_tokens. `summarize(top_k)` devuelve el
+    resumen con las top_k posiciones detalladas y el resto agregado; se prueba
+    con cada vez menos detalle hasta que cabe.
+    """
+    summary = ""
+    for top_k in PORTFOLIO_TOP_K_STEPS:
+        summary = summarize(top_k)
+        if count_tokens(summary) <= max_tokens:
+            return summary
+    return truncate_to_tokens(summary, max_tokens)
+
+
+class ChatContext:
+    """
+    Construye los mensajes del chat general dentro de un presupuesto de tokens:
+    ventana deslizante con los turnos recientes más un resumen incremental de
+    los turnos antiguos. El estado (resumen y mensajes ya resumidos) vive en un
+    dict, normalmente st.session_state["chat_context"].
+    """
+
+    def __init__(self, state, summarizer, budget=CHAT_TOKEN_BUDGET):
+        self.state = state
+        self.state.setdefault("summary", "")
+        self.state.setdefault("covered", 0)
+        self.summarizer = summarizer
+        self.budget = budget
+
+    def _fold(self, messages):
+        """Incorpora los mensajes dados al resumen de la conversación."""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        previous = self.state["summary"]
+        try:
+            summary = self.summarizer(previous, transcript)
+        except Exception:
+            # Sin LLM disponible: resumen extractivo (inicio de cada mensaje)
+            summary = "\n".join(filter(None, [previous] + [f"{m['role']}: {m['content'][:200]}" for m in messages]))
+        self.state["summary"] = truncate_to_tokens(summary, int(self.budget * SUMMARY_SHARE))
+
+    def build(self, messages, summarize_portfolio):
+        """
+        Devuelve la lista de mensajes para OpenAI: prompt de sistema con el
+        portafolio comprimido, resumen de la conversación antigua (si lo hay) y
+        los turnos más recientes que quepan en el presupuesto.
+        """
+        portfolio = fit_portfolio_summary(summarize_portfolio, int(self.budget * PORTFOLIO_SHARE))
+        system = {"role": "system", "content": SYSTEM_PROMPT + portfolio}
+        window_budget = self.budget - count_message_tokens(system) - int(self.budget * SUMMARY_SHARE)
+
+        # Si el resumen quedó por delante del historial (p.ej. se reinició el chat), empezar de cero
+        if self.state["covered"] > len(messages):
+            self.state["summary"], self.state["covered"] = "", 0
+
+        # Ventana de turnos recientes, siempre con al menos el último mensaje
+        start = len(messages)
+        used = 0
+        while start > self.state["covered"]:
+            cost = count_message_tokens(messages[start - 1])
+            if used + cost > window_budget and start < len(messages):
+                break
+            used += cost
+            start -= 1
+
+        if start > self.state["covered"]:
+            # Al desbordar se resume hasta dejar la ventana a la mitad, para no
+            # tener que volver a resumir en cada turno
+            while start < len(messages) - 1 and used > window_budget // 2:
+                used -= count_message_tokens(messages[start])
+                start += 1
+            self._fold(messages[self.state["covered"]:start])
+            self.state["covered"] = start
+
+        context = [system]
+        if self.state["summary"]:
+            context.append({"role": "system", "content": "Resumen de la conversación anterior:\n" + self.state["summary"]})
+        context.extend(messages[self.state["covered"]:])
+
+        # El último mensaje siempre entra, pero recortado a lo que quede del
+        # presupuesto (p.ej. un texto largo pegado por el usuario); se reservan
+        # los tokens de formato del mensaje y uno para la elipsis
+        remaining = self.budget - sum(count_message_tokens(m) for m in context[:-1])
+        if count_message_tokens(context[-1]) > remaining:
+            last = context[-1]
+            context[-1] = {**last, "content": truncate_to_tokens(last.get("content", ""), max(remaining - 5, 0))}
+        return context
@@ -0,0 +1,111 @@
+import re
+from pool_filters import normalize_chain_name
+from pool_store import TOKEN_ALIASES, split_symbol
+
+ALTERNATIVES_KEYWORDS = ["alternativas", "alternatives", "alternativa", "alternative"]
+POSITION_KEYWORDS = ["posicion", "posición", "position"]
+
+# Palabras frecuentes en las preguntas que también existen como símbolo de algún
+# token en DeFiLlama y no deben tomarse como tal
+STOPWORDS = {
+    'A', 'AL', 'ALTERNATIVA', 'ALTERNATIVAS', 'ALTERNATIVE', 'ALTERNATIVES', 'AND', 'ANY', 'APY',
+    'ARE', 'BEST', 'BLOCKCHAIN', 'BUSCA', 'CADENA', 'CHAIN', 'CON', 'DAME', 'DE', 'DEL', 'EL',
+    'EN', 'ES', 'FARM', 'FIND', 'FOR', 'GIVE', 'HAY', 'IN', 'IS', 'LA', 'LAS', 'LO', 'LOS', 'ME',
+    'MEJOR', 'MEJORES', 'MI', 'MIS', 'MUESTRA', 'MY', 'O', 'OF', 'ON', 'OPCIONES', 'OPTIONS', 'OR',
+    'OTRAS', 'PARA', 'POOL', 'POOLS', 'POR', 'POSICION', 'POSICIÓN', 'POSITION', 'PROTOCOL',
+    'PROTOCOLO', 'QUE', 'QUIERO', 'RED', 'SE', 'SHOW', 'SOME', 'STAKING', 'SU', 'THE', 'TIENES',
+    'TO', 'TOKEN', 'TU', 'TVL', 'UN', 'UNA', 'WHAT', 'Y', 'YIELD',
+}
+
+_POSITION_RE = re.compile(r'(?:posici[oó]n|position)\s*(?:#|n[º°o]\.?|n[uú]mero|number)?\s*(\d+)', re.IGNORECASE)
+_HASH_NUMBER_RE = re.compile(r'#\s*(\d+)')
+# Blockchain o protocolo introducidos por una preposición ("en arbitrum", "on aave")
+_SCOPE_RE = re.compile(r'\b(?:en|on|chain|blockchain|cadena|red|protocolo|protocol)\s+([\w.-]+)', re.IGNORECASE)
+_WORD_RE = re.compile(r'[\w./-]+')
+
+
+def _project_families(projects):
+    """{'aave': 'aave', 'aave-v3': 'aave', ...}: nombre de proyecto y su familia sin versión."""
+    families = {}
+    for project in projects:
+        project = str(project).lower()
+        if not project:
+            continue
+        families[project] = project
+        families.setdefault(project.split('-')[0], project.split('-')[0])
+    return families
+
+
+def parse_alternatives_request(text, store=None, portfolio_symbols=()):
+    """
+    Extrae de forma local y determinista la intención de una petición de
+    alternativas: número de posición, token, blockchain y protocolo.
+
+    Los tokens se buscan en el universo de tokens del PoolStore (índice
+    invertido), las blockchains con normalize_chain_name y los protocolos
+    contra los proyectos conocidos. Devuelve un dict con 'position', 'token',
+    'chain', 'protocol' y 'ambiguous' (True si hace falta recurrir al LLM).
+    """
+    intent = {'position': None, 'token': None, 'chain': None, 'protocol': None, 'ambiguous': False}
+    lowered = text.lower()
+    wants_position = any(word in lowered for word in POSITION_KEYWORDS)
+
+    # Número de posición
+    if wants_position:
+        numbers = {int(n) for n in _POSITION_RE.findall(text)} or {int(n) for n in _HASH_NUMBER_RE.findall(text)}
+        if len(numbers) == 1:
+            intent['position'] = numbers.pop()
+        else:
+            intent['ambiguous'] = True
+
+    known_chains = set(store.chain_lower) if store is not None else set()
+    families = _project_families(store.categories['project']) if store is not None else {}
+
+    universe = store.token_index if store is not None else None
+
+    # Blockchain / protocolo ("en arbitrum", "en aave"). Sólo el nombre completo
+    # de la blockchain cuenta como tal: los alias que son tickers ("en ETH",
+    # "on OP") o cualquier símbolo del universo de tokens siguen siendo tokens
+    consumed = set()
+    for word in _SCOPE_RE.findall(text):
+        word_lower = word.lower().strip('.-')
+        chain = normalize_chain_name(word_lower)
+        is_chain_name = chain.lower() == word_lower and chain.lower() in known_chains
+        is_token = universe is not None and word_lower.upper() in universe
+        if intent['chain'] is None and is_chain_name and not is_token:
+            intent['chain'] = chain
+            consumed.add(word_lower.upper())
+        elif intent['protocol'] is None and word_lower in families:
+            intent['protocol'] = families[word_lower]
+            consumed.add(word_lower.upper())
+
+    if wants_position:
+        return intent
+
+    # Token: palabras del mensaje que existen en el universo de tokens
+    owned = set()
+    for symbol in portfolio_symbols:
+        owned.update(split_symbol(str(symbol)))
+    candidates = []
+    for word in _WORD_RE.findall(text):
+        word = word.strip('.-/').upper()
+        if len(word) < 2 or word in STOPWORDS or word in consumed or word.isdigit():
+            continue
+        parts = split_symbol(word)
+        if universe is not None:
+            known = all(part in universe for part in parts)
+        else:
+            known = all(part in owned or part in TOKEN_ALIASES for part in parts)
+        if known and word not in candidates:
+            candidates.append(word)
+
+    if len(candidates) > 1:
+        # Si sólo uno está en el portafolio del usuario, es ése
+        in_portfolio = [c for c in candidates if any(part in owned for part in split_symbol(c))]
+        if len(in_portfolio) == 1:
+            candidates = in_portfolio
+    if len(candidates) == 1:
+        intent['token'] = candidates[0]
+    else:
+        intent['ambiguous'] = True
+    return intent
@@ -0,0 +1,26 @@
+import threading
+from sqlalchemy import create_engine
+
+
+class LazyEngine:
+    """
+    Motor de SQLAlchemy que se crea (junto con las tablas de `metadata`) en el
+    primer uso, no al importar el módulo. Con SQLite la conexión se comparte
+    entre hilos y espera a los bloqueos de escritura de otros procesos.
+    """
+
+    def __init__(self, url, metadata):
+        self.url = url
+        self.metadata = metadata
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    connect_args = {"check_same_thread": False, "timeout": 30} if self.url.startswith("sqlite") else {}
+                    engine = create_engine(self.url, connect_args=connect_args)
+                    self.metadata.create_all(engine)
+                    self._engine = engine
+        return self._engine
@@ -1,10 +1,14 @@
 # Chat.py
 import streamlit as st
-from utils import init_chat_history, render_chat
+from chat import init_chat_history, render_chat
+from metrics import start_exporters
 
 def main():
     st.set_page_config(page_title="Mi Agente DeFi - Chat", layout="wide")
     st.title("Chat DeFi")
+
+    # Exportación de métricas (servidor /metrics y/o fichero), una vez por proceso
+    start_exporters()
         
     init_chat_history()
     render_chat()
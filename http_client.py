@@ -0,0 +1,113 @@
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from metrics import increment, span
+
+# Timeouts (conexión, lectura) en segundos para las APIs externas
+HTTP_TIMEOUT = (5, 30)
+# Conexiones por host que se mantienen abiertas (al menos tantas como wallets en paralelo)
+HTTP_POOL_MAXSIZE = max(int(os.environ.get("MAX_WALLET_WORKERS", 8)), 10)
+# Codificaciones que urllib3 sabe descomprimir: gzip y deflate siempre, br si
+# está instalado brotli (y zstd si está zstandard)
+HTTP_ACCEPT_ENCODING = ACCEPT_ENCODING
+# Caracteres del cuerpo de una respuesta de error que se incluyen en el mensaje
+HTTP_ERROR_BODY_CHARS = 500
+# Tamaño de los trozos al leer respuestas en streaming
+HTTP_CHUNK_SIZE = 64 * 1024
+
+def _build_http_session():
+    """Sesión HTTP compartida con keep-alive, pool de conexiones, compresión y reintentos con backoff."""
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = HTTP_ACCEPT_ENCODING
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+http_session = _build_http_session()
+
+def reset_http_session():
+    """
+    Cierra la sesión compartida y crea otra nueva. Un proceso hijo (fork) debe
+    llamarla antes de hacer peticiones: los sockets keep-alive heredados del
+    padre no pueden compartirse entre procesos.
+    """
+    global http_session
+    http_session.close()
+    http_session = _build_http_session()
+
+def http_error(message, url, status_code=None):
+    """Objeto de error común a todas las llamadas HTTP: {'error', 'status_code', 'url'}."""
+    return {"error": message, "status_code": status_code, "url": url}
+
+def response_validators(response):
+    """Validadores (ETag / Last-Modified) de una respuesta, para revalidarla después."""
+    validators = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    return {k: v for k, v in validators.items() if v} or None
+
+def _conditional_headers(validators):
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def http_get(url, span_name, headers=None, timeout=HTTP_TIMEOUT, validators=None, parse=None):
+    """
+    GET con la sesión compartida, medido como el tramo `span_name`.
+
+    - Con `validators` (de una respuesta anterior) se envía If-None-Match /
+      If-Modified-Since; si el recurso no cambió se devuelve
+      {'status': 'not_modified', 'validators': ...} sin descargar el cuerpo.
+    - `parse(chunks)` recibe el cuerpo ya descomprimido por trozos; por defecto
+      se decodifica como JSON.
+    - Correcto: {'status': 'success', 'data': ..., 'validators': ...}.
+      Error: ver http_error.
+
+    Los bytes del tramo son los transferidos por la red (comprimidos); los
+    descomprimidos se suman al contador '<span_name>.decoded_bytes'.
+    """
+    request_headers = {**(headers or {}), **_conditional_headers(validators)}
+
+    def counted(chunks, decoded):
+        for chunk in chunks:
+            decoded[0] += len(chunk)
+            yield chunk
+
+    with span(span_name) as call:
+        try:
+            with http_session.get(url, headers=request_headers, timeout=timeout, stream=True) as response:
+                if response.status_code == 304:
+                    increment(f"{span_name}.not_modified")
+                    return {"status": "not_modified", "validators": response_validators(response) or validators}
+                decoded = [0]
+                chunks = counted(response.iter_content(chunk_size=HTTP_CHUNK_SIZE), decoded)
+                try:
+                    if response.status_code != 200:
+                        call.fail()
+                        text = b"".join(chunks).decode(response.encoding or 'utf-8', errors='replace')
+                        return http_error(f"Error {response.status_code}: {text[:HTTP_ERROR_BODY_CHARS]}",
+                                          url, response.status_code)
+                    data = parse(chunks) if parse else json.loads(b"".join(chunks))
+                finally:
+                    call.add_bytes(response.raw.tell())
+                    increment(f"{span_name}.decoded_bytes", decoded[0])
+                return {"status": "success", "data": data, "validators": response_validators(response)}
+        except Exception as e:
+            call.fail()
+            return http_error(f"Exception occurred: {str(e)}", url)
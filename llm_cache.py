@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import time
+from db import LazyEngine
+from metrics import increment, observe, span
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, func, select, update
+
+# Base de datos SQLite donde se guardan las respuestas de OpenAI
+LLM_CACHE_URL = os.environ.get("LLM_CACHE_URL", "sqlite:///.llm_cache.sqlite")
+# Segundos que una respuesta se considera válida
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+# Número máximo de respuestas guardadas; se expulsan las usadas hace más tiempo (LRU)
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000))
+
+_metadata = MetaData()
+llm_responses = Table(
+    "llm_responses",
+    _metadata,
+    Column("key", String(64), primary_key=True),
+    Column("model", String(64)),
+    Column("response", Text, nullable=False),
+    Column("created_at", Float, nullable=False),
+    Column("last_used_at", Float, nullable=False, index=True),
+    Column("size", Integer, nullable=False),
+)
+
+
+def cache_key(**params):
+    """
+    Clave direccionada por contenido: hash de modelo + mensajes + parámetros.
+    La api_key no forma parte de la clave.
+    """
+    payload = {k: v for k, v in params.items() if k not in ("api_key", "stream")}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Caché persistente de respuestas de ChatCompletion con TTL y expulsión LRU."""
+
+    def __init__(self, url=LLM_CACHE_URL, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.url = url
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db = LazyEngine(url, _metadata)
+
+    @property
+    def engine(self):
+        return self._db.get()
+
+    def get(self, key):
+        """Respuesta guardada para la clave, o None si no existe o caducó."""
+        now = time.time()
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(llm_responses.c.response, llm_responses.c.created_at).where(llm_responses.c.key == key)
+            ).first()
+            if row is None:
+                return None
+            if now - row.created_at > self.ttl:
+                conn.execute(delete(llm_responses).where(llm_responses.c.key == key))
+                return None
+            conn.execute(update(llm_responses).where(llm_responses.c.key == key).values(last_used_at=now))
+        return json.loads(row.response)
+
+    def put(self, key, response, model=None):
+        now = time.time()
+        raw = json.dumps(response, ensure_ascii=False)
+        with self.engine.begin() as conn:
+            conn.execute(delete(llm_responses).where(llm_responses.c.key == key))
+            conn.execute(llm_responses.insert().values(
+                key=key, model=model, response=raw, created_at=now, last_used_at=now, size=len(raw)
+            ))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute(delete(llm_responses).where(llm_responses.c.created_at < now - self.ttl))
+        count = conn.execute(select(func.count()).select_from(llm_responses)).scalar()
+        excess = count - self.max_entries
+        if excess > 0:
+            oldest = select(llm_responses.c.key).order_by(llm_responses.c.last_used_at).limit(excess)
+            conn.execute(delete(llm_responses).where(llm_responses.c.key.in_(oldest.scalar_subquery())))
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.execute(delete(llm_responses))
+
+
+llm_cache = LLMCache()
+
+
+def _cache_get(key):
+    try:
+        return llm_cache.get(key)
+    except Exception:
+        return None
+
+
+def _cache_put(key, response, model):
+    try:
+        llm_cache.put(key, response, model=model)
+    except Exception:
+        pass
+
+
+def cached_chat_completion(**params):
+    """
+    Igual que openai.ChatCompletion.create, pero sirve desde la caché las
+    peticiones idénticas ya respondidas. Si la caché falla, se llama a OpenAI
+    igualmente; los errores de OpenAI se propagan como antes.
+    """
+    key = cache_key(**params)
+    cached = _cache_get(key)
+    if cached is not None:
+        increment("openai.chat.cache_hit")
+        return cached
+
+    # openai se importa en la primera llamada, no al cargar la página
+    import openai
+
+    with span("openai.chat") as call:
+        response = openai.ChatCompletion.create(**params)
+        call.add_bytes(len(response["choices"][0]["message"]["content"].encode("utf-8")))
+    _cache_put(key, response, params.get("model"))
+    return response
+
+
+def stream_chat_completion(cache=True, **params):
+    """
+    Versión en streaming: genera los fragmentos de texto de la respuesta a
+    medida que llegan. Si la respuesta está en caché se genera de una vez.
+    Sólo se guarda en caché una respuesta completa; si el consumidor deja de
+    leer (p.ej. el usuario envía otro mensaje) se cierra la conexión con OpenAI.
+    """
+    key = cache_key(**params) if cache else None
+    cached = _cache_get(key) if cache else None
+    if cached is not None:
+        increment("openai.chat.cache_hit")
+        yield cached["choices"][0]["message"]["content"]
+        return
+
+    import openai
+
+    started = time.perf_counter()
+    parts = []
+    failed = True
+    try:
+        stream = openai.ChatCompletion.create(stream=True, **params)
+        try:
+            for chunk in stream:
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    if not parts:
+                        observe("openai.chat.first_token", time.perf_counter() - started)
+                    parts.append(delta)
+                    yield delta
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        failed = False
+    except GeneratorExit:
+        # El consumidor dejó de leer: no es un fallo de OpenAI
+        failed = False
+        raise
+    finally:
+        observe("openai.chat.stream", time.perf_counter() - started, failed=failed,
+                nbytes=sum(len(part.encode("utf-8")) for part in parts))
+
+    if cache:
+        response = {"choices": [{"message": {"role": "assistant", "content": "".join(parts)}}]}
+        _cache_put(key, response, params.get("model"))
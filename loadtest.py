@@ -0,0 +1,427 @@
+"""
+Pruebas de carga sin red: servidores locales que imitan Merlin, DeFiLlama y
+OpenAI, y un driver que simula N sesiones de Streamlit concurrentes.
+
+    # Todo en un proceso: servidores falsos + sesiones simuladas
+    python loadtest.py run --sessions 20 --iterations 3 --latency-merlin 300 --error-rate 0.02
+
+    # Sólo los servidores, para usar la app a mano contra ellos
+    python loadtest.py serve --port 8900
+    # ...y en otra terminal, con las variables que imprime:
+    MERLIN_API_URL=... LLAMA_YIELDS_URL=... OPENAI_API_BASE=... streamlit run home.py
+
+Cada sesión recorre las páginas reales con streamlit.testing (AppTest):
+análisis del portafolio, análisis de las alternativas y dos mensajes de chat.
+El informe incluye p50/p95/p99 por paso y las llamadas salientes que ha
+recibido cada servidor falso.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SERVICES = ['merlin', 'defillama', 'openai']
+DEFAULT_LATENCY_MS = {'merlin': 400, 'defillama': 1500, 'openai': 800}
+
+CHAT_QUESTIONS = [
+    "¿Cómo está diversificado mi portafolio?",
+    "Busca alternativas para mi posición 1",
+]
+FAKE_COMPLETION = (
+    "La posición tiene un APY competitivo, pero las alternativas ofrecen un rendimiento mayor con un TVL "
+    "suficiente. Conviene valorar el riesgo del protocolo, la liquidez y los costes de mover el capital "
+    "antes de cambiar."
+)
+
+
+########################################################################
+#                         SERVIDORES FALSOS                            #
+########################################################################
+
+class FakeServices:
+    """
+    Servidor HTTP local con las rutas que consume la app:
+      GET  /merlin/<dirección>        → userDeFiPositions de Merlin
+      GET  /pools                     → /pools de DeFiLlama (gzip, ETag y 304)
+      POST /v1/chat/completions       → ChatCompletion de OpenAI (también stream SSE)
+    con latencia (ms, ±50%), tasa de errores y tamaño de respuesta configurables.
+    """
+
+    def __init__(self, port=0, latency_ms=None, error_rate=0.0, pools=20000, positions=30,
+                 completion_words=60, token_delay_ms=20, seed=0):
+        self.latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.error_rate = error_rate
+        self.pools = pools
+        self.positions = positions
+        self.completion_words = completion_words
+        self.token_delay_ms = token_delay_ms
+        self.stats = {service: {'requests': 0, 'errors': 0, 'bytes': 0} for service in SERVICES}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._merlin_payloads = {}
+        self._pools_payload = None
+        self._pools_gzip = None
+        self._pools_etag = None
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environ(self):
+        """Variables de entorno que apuntan la app a estos servidores."""
+        return {
+            'MERLIN_API_URL': f"{self.base_url}/merlin",
+            'LLAMA_YIELDS_URL': f"{self.base_url}/pools",
+            'OPENAI_API_BASE': f"{self.base_url}/v1",
+        }
+
+    def start(self):
+        # Los generadores de datos sintéticos están en benchmark.py
+        from benchmark import synthetic_llama_pools
+        self._pools_payload = json.dumps(synthetic_llama_pools(self.pools)).encode('utf-8')
+        self._pools_gzip = gzip.compress(self._pools_payload)
+        self._pools_etag = f'"{hashlib.sha1(self._pools_payload).hexdigest()[:16]}"'
+        threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _merlin_payload(self, address):
+        from benchmark import synthetic_merlin_positions
+        with self._lock:
+            payload = self._merlin_payloads.get(address)
+        if payload is None:
+            payload = json.dumps(synthetic_merlin_positions(self.positions, seed=address)).encode('utf-8')
+            with self._lock:
+                self._merlin_payloads[address] = payload
+        return payload
+
+    def _sleep(self, service):
+        latency = self.latency_ms.get(service, 0) / 1000
+        with self._lock:
+            jitter = self._rng.uniform(0.5, 1.5)
+        time.sleep(latency * jitter)
+
+    def _should_fail(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def _count(self, service, nbytes=0, error=False):
+        with self._lock:
+            stats = self.stats[service]
+            stats['requests'] += 1
+            stats['errors'] += error
+            stats['bytes'] += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            return {service: dict(stats) for service, stats in self.stats.items()}
+
+    def _completion_words(self):
+        words = FAKE_COMPLETION.split()
+        return [words[i % len(words)] for i in range(self.completion_words)]
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self, service, status=500):
+                body = json.dumps({'error': {'message': 'Fallo simulado', 'type': 'server_error'}}).encode('utf-8')
+                services._count(service, len(body), error=True)
+                self._send(status, body)
+
+            def do_GET(self):
+                if self.path.startswith('/merlin/'):
+                    service = 'merlin'
+                    services._sleep(service)
+                    if not self.headers.get('Authorization'):
+                        return self._error(service, 401)
+                    if services._should_fail():
+                        return self._error(service, services._rng.choice([429, 500, 503]))
+                    body = services._merlin_payload(self.path[len('/merlin/'):])
+                elif self.path.split('?')[0] == '/pools':
+                    service = 'defillama'
+                    services._sleep(service)
+                    if services._should_fail():
+                        return self._error(service)
+                    # Como DeFiLlama: revalidación por ETag y compresión negociada
+                    headers = {'ETag': services._pools_etag}
+                    if self.headers.get('If-None-Match') == services._pools_etag:
+                        services._count(service)
+                        return self._send(304, b'', headers=headers)
+                    body = services._pools_payload
+                    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                        body, headers['Content-Encoding'] = services._pools_gzip, 'gzip'
+                    services._count(service, len(body))
+                    return self._send(200, body, headers=headers)
+                else:
+                    return self._send(404, b'{}')
+                services._count(service, len(body))
+                self._send(200, body)
+
+            def do_POST(self):
+                if self.path.split('?')[0] != '/v1/chat/completions':
+                    return self._send(404, b'{}')
+                service = 'openai'
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                services._sleep(service)
+                if services._should_fail():
+                    return self._error(service)
+                words = services._completion_words()
+                model = request.get('model', 'gpt-3.5-turbo')
+                if not request.get('stream'):
+                    body = json.dumps({
+                        'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': ' '.join(words)}}],
+                        'usage': {'prompt_tokens': 0, 'completion_tokens': len(words), 'total_tokens': len(words)},
+                    }).encode('utf-8')
+                    services._count(service, len(body))
+                    return self._send(200, body)
+
+                # Respuesta en streaming (server-sent events), un fragmento por palabra
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                sent = 0
+                try:
+                    for i, word in enumerate(words):
+                        chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'model': model,
+                                 'choices': [{'index': 0, 'delta': {'content': word if i == 0 else ' ' + word},
+                                              'finish_reason': None}]}
+                        data = f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+                        self.wfile.write(data)
+                        self.wfile.flush()
+                        sent += len(data)
+                        time.sleep(services.token_delay_ms / 1000)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # el cliente dejó de leer (p.ej. canceló el stream)
+                services._count(service, sent)
+                self.close_connection = True
+
+        return Handler
+
+
+########################################################################
+#                       SESIONES SIMULADAS                             #
+########################################################################
+
+def _percentiles(samples):
+    import numpy as np
+    values = np.asarray(samples, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_s': p50, 'p95_s': p95, 'p99_s': p99, 'mean_s': float(values.mean()), 'max_s': float(values.max())}
+
+
+class LoadDriver:
+    """Ejecuta sesiones de AppTest en paralelo y acumula la latencia de cada paso."""
+
+    def __init__(self, secrets, timeout=120):
+        self.secrets = secrets
+        self.timeout = timeout
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def _step(self, name, app, action=None):
+        started = time.perf_counter()
+        failed = False
+        try:
+            (action or app).run()
+            failed = len(app.exception) > 0
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples.setdefault(name, []).append(elapsed)
+            self.errors[name] = self.errors.get(name, 0) + failed
+        return not failed
+
+    def _app(self, path):
+        from streamlit.testing.v1 import AppTest
+        app = AppTest.from_file(os.path.join(ROOT, path), default_timeout=self.timeout)
+        for key, value in self.secrets.items():
+            app.secrets[key] = value
+        return app
+
+    def session(self, addresses, flows):
+        """Una sesión: portafolio (+ análisis de alternativas) y chat."""
+        combined_df = None
+        if 'portfolio' in flows:
+            app = self._app(os.path.join('pages', '1_portfolio.py'))
+            app.run()
+            app.sidebar.text_area[0].input("\n".join(addresses))
+            if self._step('portfolio.analyze', app, app.sidebar.button[0].click()):
+                combined_df = app.session_state['combined_df'] if 'combined_df' in app.session_state else None
+                buttons = [b for b in app.button if b.label.startswith("Generar análisis de todas")]
+                if buttons:
+                    self._step('portfolio.analyses', app, buttons[0].click())
+        if 'chat' in flows and combined_df is not None:
+            app = self._app('home.py')
+            app.session_state['combined_df'] = combined_df
+            app.run()
+            for i, question in enumerate(CHAT_QUESTIONS):
+                step = 'chat.general' if i == 0 else 'chat.alternatives'
+                self._step(step, app, app.chat_input[0].set_value(question))
+
+    def report(self):
+        with self._lock:
+            return {name: {'count': len(samples), 'errors': self.errors.get(name, 0), **_percentiles(samples)}
+                    for name, samples in self.samples.items()}
+
+
+def run_load(services, sessions=10, iterations=1, wallets_per_session=3, distinct_wallets=50,
+             flows=('portfolio', 'chat'), timeout=120, seed=0):
+    """
+    Simula `sessions` sesiones concurrentes, cada una repitiendo los flujos
+    `iterations` veces con wallets tomadas de un conjunto de `distinct_wallets`
+    (direcciones repetidas entre sesiones, como en la realidad, para que se
+    note el efecto de las cachés). Devuelve el informe como dict.
+    """
+    from metrics import metrics
+
+    rng = random.Random(seed)
+    wallets = [f"0x{rng.getrandbits(160):040x}" for _ in range(distinct_wallets)]
+    plans = [[rng.sample(wallets, min(wallets_per_session, len(wallets))) for _ in range(iterations)]
+             for _ in range(sessions)]
+    driver = LoadDriver({'merlin_api_key': 'fake-merlin-key', 'openai_api_key': 'fake-openai-key'}, timeout)
+
+    def run_session(plan):
+        for addresses in plan:
+            driver.session(addresses, flows)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as executor:
+        list(executor.map(run_session, plans))
+    wall = time.time() - started
+
+    return {
+        'config': {
+            'sessions': sessions, 'iterations': iterations, 'wallets_per_session': wallets_per_session,
+            'distinct_wallets': distinct_wallets, 'flows': list(flows), 'latency_ms': services.latency_ms,
+            'error_rate': services.error_rate, 'pools': services.pools, 'positions': services.positions,
+        },
+        'wall_seconds': wall,
+        'pages': driver.report(),
+        'outbound': services.snapshot(),
+        'app_metrics': metrics.snapshot(),
+    }
+
+
+def _print_report(report):
+    print(f"\n{report['config']['sessions']} sesiones x {report['config']['iterations']} iteraciones "
+          f"en {report['wall_seconds']:.1f}s")
+    print(f"\n{'Paso':<22}{'n':>6}{'err':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'máx':>10}")
+    for name, stats in sorted(report['pages'].items()):
+        print(f"{name:<22}{stats['count']:>6}{stats['errors']:>6}"
+              + "".join(f"{stats[k] * 1000:>8.0f}ms" for k in ('p50_s', 'p95_s', 'p99_s', 'max_s')))
+    print(f"\n{'Servicio':<22}{'llamadas':>10}{'errores':>10}{'MiB':>10}")
+    for service, stats in report['outbound'].items():
+        print(f"{service:<22}{stats['requests']:>10}{stats['errors']:>10}{stats['bytes'] / 2**20:>10.2f}")
+    counters = report['app_metrics']['counters']
+    if counters:
+        print("\nContadores de la app: " + ", ".join(f"{k}={v}" for k, v in counters.items()))
+
+
+def _services_from_args(args):
+    latency = {'merlin': args.latency_merlin, 'defillama': args.latency_defillama, 'openai': args.latency_openai}
+    return FakeServices(port=args.port, latency_ms=latency, error_rate=args.error_rate, pools=args.pools,
+                        positions=args.positions, completion_words=args.completion_words,
+                        token_delay_ms=args.token_delay)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pruebas de carga con servidores falsos de Merlin, DeFiLlama y OpenAI")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ('serve', 'run'):
+        p = sub.add_parser(name)
+        p.add_argument("--port", type=int, default=8900 if name == 'serve' else 0)
+        p.add_argument("--latency-merlin", type=float, default=DEFAULT_LATENCY_MS['merlin'], help="ms")
+        p.add_argument("--latency-defillama", type=float, default=DEFAULT_LATENCY_MS['defillama'], help="ms")
+        p.add_argument("--latency-openai", type=float, default=DEFAULT_LATENCY_MS['openai'], help="ms hasta la primera palabra")
+        p.add_argument("--token-delay", type=float, default=20, help="ms entre palabras del stream de OpenAI")
+        p.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas con error (0-1)")
+        p.add_argument("--pools", type=int, default=20000, help="Pools en la respuesta de DeFiLlama")
+        p.add_argument("--positions", type=int, default=30, help="Posiciones por wallet en Merlin")
+        p.add_argument("--completion-words", type=int, default=60, help="Palabras por respuesta de OpenAI")
+    run = sub.choices['run']
+    run.add_argument("--sessions", type=int, default=10)
+    run.add_argument("--iterations", type=int, default=1)
+    run.add_argument("--wallets-per-session", type=int, default=3)
+    run.add_argument("--distinct-wallets", type=int, default=50)
+    run.add_argument("--flows", default="portfolio,chat", help="Flujos a simular: portfolio, chat")
+    run.add_argument("--timeout", type=float, default=120, help="Segundos máximos por paso")
+    run.add_argument("--keep-caches", action="store_true",
+                     help="Usar las cachés en disco normales (LLM y snapshot) en lugar de unas temporales")
+    run.add_argument("--out", help="Guardar el informe en este fichero JSON")
+    args = parser.parse_args(argv)
+
+    services = _services_from_args(args)
+    # El entorno debe apuntar a los servidores falsos antes de importar la app
+    os.environ.update(services.environ())
+    if args.command == 'run':
+        # Los avisos de Streamlit de cada ejecución de AppTest tapan el informe
+        os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    if args.command == 'run' and not args.keep_caches:
+        scratch = tempfile.mkdtemp(prefix="loadtest-")
+        os.environ['LLM_CACHE_URL'] = f"sqlite:///{os.path.join(scratch, 'llm_cache.sqlite')}"
+        os.environ['LLAMA_SNAPSHOT_DIR'] = os.path.join(scratch, 'yields_snapshot')
+        os.environ['YIELD_HISTORY_URL'] = f"sqlite:///{os.path.join(scratch, 'yield_history.sqlite')}"
+    services.start()
+
+    if args.command == 'serve':
+        for key, value in services.environ().items():
+            print(f"export {key}={value}")
+        print("Servidores falsos en marcha (Ctrl+C para salir)", file=sys.stderr)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            services.stop()
+        return 0
+
+    flows = tuple(flow.strip() for flow in args.flows.split(',') if flow.strip())
+    report = run_load(services, sessions=args.sessions, iterations=args.iterations,
+                      wallets_per_session=args.wallets_per_session, distinct_wallets=args.distinct_wallets,
+                      flows=flows, timeout=args.timeout)
+    services.stop()
+    _print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (segundos) de los buckets de los histogramas de latencia
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Fichero donde volcar periódicamente las métricas (.prom = texto Prometheus, otro = JSON)
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.environ.get("METRICS_FILE_INTERVAL", 15))
+# Puerto en el que servir /metrics (Prometheus) y /metrics.json; desactivado si no se define
+METRICS_PORT = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None
+# Interfaz en la que escucha el servidor de métricas (sólo local por defecto;
+# 0.0.0.0 para exponerlo, p.ej., a un Prometheus en otra máquina)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PREFIX = "defi_agent"
+
+
+class Histogram:
+    """Histograma acumulado de duraciones con buckets fijos."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimación del cuantil q interpolando dentro del bucket."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= target and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (target - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+
+class SpanStats:
+    """Métricas de un tramo: histograma de duración y contadores de llamadas, errores y bytes."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+
+
+class Span:
+    """Tramo en curso; permite marcarlo como fallido y sumar bytes transferidos."""
+
+    __slots__ = ('failed', 'bytes')
+
+    def __init__(self):
+        self.failed = False
+        self.bytes = 0
+
+    def fail(self):
+        self.failed = True
+
+    def add_bytes(self, n):
+        self.bytes += n
+
+
+class MetricsRegistry:
+    """
+    Métricas del proceso (compartidas por todas las sesiones): tramos con
+    histograma de latencia y contadores sueltos (aciertos de caché, etc.).
+    """
+
+    def __init__(self):
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def observe(self, name, seconds, failed=False, nbytes=0):
+        """Registra una llamada ya medida del tramo `name`."""
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = SpanStats()
+            stats.latency.observe(seconds)
+            stats.calls += 1
+            stats.errors += failed
+            stats.bytes += nbytes
+
+    def span(self, name):
+        """
+        Context manager que mide un tramo. Una excepción cuenta como error (y se
+        propaga); los errores devueltos como {'error': ...} se marcan con fail().
+        """
+        return _SpanContext(self, name)
+
+    def timed(self, name):
+        """Decorador: mide cada llamada a la función como el tramo `name`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name) as span:
+                    result = fn(*args, **kwargs)
+                    if isinstance(result, dict) and 'error' in result:
+                        span.fail()
+                    return result
+            return wrapper
+        return decorator
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """Estado actual serializable a JSON."""
+        with self._lock:
+            spans = {}
+            for name, stats in sorted(self._spans.items()):
+                latency = stats.latency
+                spans[name] = {
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'bytes': stats.bytes,
+                    'sum_seconds': latency.sum,
+                    'mean_seconds': latency.sum / latency.count if latency.count else None,
+                    'p50_seconds': latency.quantile(0.5),
+                    'p95_seconds': latency.quantile(0.95),
+                    'p99_seconds': latency.quantile(0.99),
+                    'max_seconds': latency.max,
+                    'buckets': dict(zip([*map(str, latency.buckets), '+Inf'], latency.counts)),
+                }
+            return {
+                'started_at': self.started_at,
+                'uptime_seconds': time.time() - self.started_at,
+                'spans': spans,
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Métricas en formato de texto de Prometheus."""
+        snapshot = self.snapshot()
+        p = METRICS_PREFIX
+        lines = [
+            f"# HELP {p}_span_duration_seconds Duración de los tramos instrumentados",
+            f"# TYPE {p}_span_duration_seconds histogram",
+        ]
+        for name, span in snapshot['spans'].items():
+            cumulative = 0
+            for le, count in span['buckets'].items():
+                cumulative += count
+                lines.append(f'{p}_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{p}_span_duration_seconds_sum{{span="{name}"}} {span["sum_seconds"]}')
+            lines.append(f'{p}_span_duration_seconds_count{{span="{name}"}} {span["calls"]}')
+        for metric, field, help_text in (
+            ('span_calls_total', 'calls', 'Llamadas por tramo'),
+            ('span_errors_total', 'errors', 'Llamadas fallidas por tramo'),
+            ('span_bytes_total', 'bytes', 'Bytes transferidos por tramo'),
+        ):
+            lines.append(f"# HELP {p}_{metric} {help_text}")
+            lines.append(f"# TYPE {p}_{metric} counter")
+            for name, span in snapshot['spans'].items():
+                lines.append(f'{p}_{metric}{{span="{name}"}} {span[field]}')
+        lines.append(f"# HELP {p}_events_total Contadores de eventos (aciertos de caché, etc.)")
+        lines.append(f"# TYPE {p}_events_total counter")
+        for name, value in snapshot['counters'].items():
+            lines.append(f'{p}_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Vuelca las métricas a un fichero (atómicamente): .prom en texto Prometheus, otro en JSON."""
+        content = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+class _SpanContext:
+    __slots__ = ('registry', 'name', 'span', 'start')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.span = Span()
+        self.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start,
+                              self.span.failed or exc_type is not None, self.span.bytes)
+        return False
+
+
+metrics = MetricsRegistry()
+span = metrics.span
+timed = metrics.timed
+increment = metrics.increment
+observe = metrics.observe
+
+
+########################################################################
+#                            EXPORTACIÓN                               #
+########################################################################
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            body, content_type = metrics.to_prometheus(), 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path.split('?')[0] == '/metrics.json':
+            body, content_type = metrics.to_json(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def _file_exporter_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            metrics.write(path)
+        except OSError:
+            pass
+
+
+def start_exporters(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_FILE_INTERVAL, host=METRICS_HOST):
+    """
+    Arranca (una sola vez por proceso) el servidor HTTP de métricas y/o el
+    volcado periódico a fichero, según METRICS_HOST/METRICS_PORT y METRICS_FILE.
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if port:
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError:
+            server = None  # puerto ocupado (p.ej. otro proceso del pool ya lo sirve)
+        if server is not None:
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    if path:
+        threading.Thread(target=_file_exporter_loop, args=(path, interval), name="metrics-file", daemon=True).start()
+
+
+def render_metrics():
+    """
+    Tiempos por tramo (Merlin, DeFiLlama, OpenAI, procesamiento) y contadores
+    del proceso, con descarga en formato Prometheus y JSON.
+    """
+    import pandas as pd
+    import streamlit as st
+
+    snapshot = metrics.snapshot()
+    st.subheader("Tiempos y llamadas")
+    if not snapshot['spans']:
+        st.info("Todavía no hay métricas registradas.")
+        return
+
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 2)
+
+    rows = [{
+        'Tramo': name,
+        'Llamadas': stats['calls'],
+        'Errores': stats['errors'],
+        'p50 (ms)': ms(stats['p50_seconds']),
+        'p95 (ms)': ms(stats['p95_seconds']),
+        'Máx (ms)': ms(stats['max_seconds']),
+        'Total (s)': round(stats['sum_seconds'], 3),
+        'Bytes': stats['bytes'],
+    } for name, stats in snapshot['spans'].items()]
+    df = pd.DataFrame(rows).sort_values('Total (s)', ascending=False)
+    st.dataframe(df, hide_index=True, use_container_width=True)
+    if snapshot['counters']:
+        st.markdown("  \n".join(f"**{name}:** {value}" for name, value in snapshot['counters'].items()))
+    st.caption(f"Acumulado del proceso desde hace {snapshot['uptime_seconds'] / 60:.0f} min (todas las sesiones).")
+
+    c1, c2 = st.columns(2)
+    c1.download_button("Exportar (Prometheus)", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+    c2.download_button("Exportar (JSON)", metrics.to_json(), file_name="metrics.json", mime="application/json")
+
@@ -1,16 +1,174 @@
+import math
 import pandas as pd
-import plotly.express as px
 import streamlit as st
-from utils import (
-    get_user_defi_positions,
+from positions import (
+    get_positions_for_wallets,
+    parse_wallet_addresses,
+    read_wallet_addresses,
     process_defi_data,
-    get_defi_llama_yields,
-    summarize_portfolio,
+    get_portfolio_summary,
     format_number,
-    get_alternatives_for_token,
-    generate_investment_analysis,
-    get_openai_api_key
 )
+from yields import get_defi_llama_yields, get_alternatives_for_portfolio, yields_offline_notice
+from analysis import generate_investment_analyses, get_openai_api_key, is_analysis_error
+from portfolio_aggregates import dataframe_fingerprint, format_numbers, get_dashboard, get_dashboard_figures
+from metrics import timed
+
+# Tamaños de página para las tablas de posiciones y alternativas
+PAGE_SIZES = [25, 50, 100]
+
+def read_wallets_file(uploaded_file):
+    """Direcciones del CSV/TXT subido en la barra lateral."""
+    if uploaded_file is None:
+        return []
+    try:
+        return read_wallet_addresses(uploaded_file)
+    except Exception as e:
+        st.sidebar.error(f"No se pudo leer el fichero: {e}")
+        return []
+
+def paginate(df, key):
+    """
+    Selector de página para una tabla: devuelve sólo el trozo de df de la página
+    actual, de modo que al navegador nunca se envía la tabla completa.
+    """
+    if len(df) <= PAGE_SIZES[0]:
+        return df
+    c1, c2 = st.columns([1, 3])
+    page_size = c1.selectbox("Filas por página", PAGE_SIZES, key=f"{key}_page_size")
+    pages = math.ceil(len(df) / page_size)
+    page = c2.number_input(f"Página (de {pages})", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    start = (int(page) - 1) * page_size
+    st.caption(f"Mostrando {start + 1}-{min(start + page_size, len(df))} de {len(df)}")
+    return df.iloc[start:start + page_size]
+
+@timed("page.portfolio.dashboard")
+def render_dashboard(combined_df):
+    """
+    Tabla de posiciones, gráficos y métricas del portafolio. Todos los
+    agregados salen de get_dashboard, memorizado por la huella de combined_df,
+    así que los reruns por otros widgets no recalculan nada.
+    """
+    dashboard = get_dashboard(combined_df)
+    st.dataframe(paginate(dashboard['display'], "positions"), use_container_width=True)
+
+    # Mostrar gráficos y métricas si hay balances
+    if dashboard['total_balance'] <= 0:
+        return False
+
+    fig, fig2 = get_dashboard_figures(combined_df)
+
+    st.subheader("Distribución de Balance USD")
+    c1, c2 = st.columns(2)
+    with c1:
+        st.plotly_chart(fig, use_container_width=True)
+    with c2:
+        st.plotly_chart(fig2, use_container_width=True)
+
+    col_a, col_b, col_c = st.columns(3)
+    col_a.metric("Total Balance USD", f"${format_number(dashboard['total_balance'])}")
+    col_b.metric("Núm. de Protocolos", dashboard['num_protocols'])
+    col_c.metric("Núm. de Posiciones", dashboard['num_positions'])
+    return True
+
+@timed("page.portfolio.alternatives")
+def render_alternatives(combined_df):
+    """
+    Alternativas por posición, paginadas. El análisis de OpenAI sólo se genera
+    para las posiciones que el usuario pide (botón en cada una o para toda la
+    página) y se guarda en session_state para no repetirlo en los reruns.
+    """
+    st.subheader("Alternativas de Inversión DeFi")
+    llama_data = get_defi_llama_yields()
+    if 'error' in llama_data:
+        st.warning("No se pudo consultar DeFiLlama.")
+        return
+
+    offline_notice = yields_offline_notice()
+    if offline_notice:
+        st.warning(offline_notice)
+
+    page_df = paginate(combined_df, "alternatives")
+    alternatives_by_row = get_alternatives_for_portfolio(page_df, llama_data)
+    fingerprint = dataframe_fingerprint(combined_df)
+    analyses = st.session_state.setdefault("analyses", {})
+    # Último fallo de cada análisis: se muestra junto al botón para reintentar
+    analysis_errors = st.session_state.setdefault("analysis_errors", {})
+    analyze_page = st.button("Generar análisis de todas las posiciones de esta página")
+    openai_key = get_openai_api_key()
+
+    placeholders = {}
+    jobs = {}
+    for idx, row in page_df.iterrows():
+        with st.expander(f"{row['token_symbol']} en {row['common_name']}"):
+            alternatives = alternatives_by_row.get(idx, [])
+            if alternatives:
+                df_alt = pd.DataFrame(alternatives).drop(columns='pool')
+                df_alt['apy'] = df_alt['apy'].map("{:.2f}%".format)
+                df_alt['tvlUsd'] = "$" + format_numbers(df_alt['tvlUsd'])
+                st.dataframe(df_alt, use_container_width=True)
+                placeholders[idx] = st.empty()
+                analysis = analyses.get((fingerprint, idx))
+                error = analysis_errors.get((fingerprint, idx))
+                if analysis is not None:
+                    placeholders[idx].markdown(f"**Análisis breve:** {analysis}")
+                elif error is not None:
+                    placeholders[idx].warning(error)
+                if analysis is None and (
+                    st.button("Reintentar análisis" if error else "Generar análisis", key=f"analysis_{idx}") or analyze_page
+                ):
+                    placeholders[idx].markdown("**Análisis breve:** _generando..._")
+                    jobs[idx] = (row.to_dict(), alternatives)
+            else:
+                st.info("No se encontraron alternativas.")
+
+    # Los análisis pedidos se generan en paralelo y cada expander se va rellenando
+    # fragmento a fragmento a medida que llega su respuesta
+    for idx, analysis, done in generate_investment_analyses(jobs, openai_key):
+        placeholders[idx].markdown(f"**Análisis breve:** {analysis}{'' if done else ' ▌'}")
+        if done:
+            # Sólo se memorizan los análisis correctos; los fallos se pueden reintentar
+            if is_analysis_error(analysis):
+                analysis_errors[(fingerprint, idx)] = analysis
+            else:
+                analyses[(fingerprint, idx)] = analysis
+                analysis_errors.pop((fingerprint, idx), None)
+
+@timed("page.portfolio.fetch")
+def fetch_portfolio(addresses, force_refresh):
+    """Consulta todas las wallets y devuelve el DataFrame combinado (o None)."""
+    wallet_dict = {f"Wallet #{i+1}": addr for i, addr in enumerate(addresses)}
+
+    wallet_frames = []
+    errors = []
+    skipped = 0
+
+    # Las wallets se consultan en paralelo sobre una sesión HTTP compartida;
+    # sólo se piden a Merlin las que no están en caché o han caducado
+    results = get_positions_for_wallets(wallet_dict, st.secrets["merlin_api_key"], force_refresh=force_refresh)
+    for wallet_label, addr in wallet_dict.items():
+        result = results[wallet_label]
+        if 'error' not in result:
+            df_wallet = process_defi_data(result)
+            skipped += df_wallet.attrs.get('skipped', 0)
+            df_wallet['wallet'] = wallet_label
+            wallet_frames.append(df_wallet)
+        else:
+            errors.append(f"Error con {wallet_label} ({addr}): {result['error']}")
+
+    combined_df = pd.concat(wallet_frames, ignore_index=True) if wallet_frames else pd.DataFrame()
+
+    if errors:
+        with st.expander(f"⚠️ {len(errors)} wallets con errores", expanded=len(errors) <= 3):
+            for err in errors:
+                st.error(err)
+    if skipped:
+        st.warning(f"Se omitieron {skipped} entradas mal formadas en la respuesta de Merlin.")
+
+    if combined_df.empty:
+        st.warning("No se encontraron posiciones DeFi > $5 para las direcciones ingresadas.")
+        return None
+    return combined_df
 
 def show_portfolio():
     st.title("Resumen de Portafolio DeFi")
@@ -22,158 +180,58 @@ def show_portfolio():
     if "analyze" not in st.session_state:
         st.session_state["analyze"] = False
 
-    # Entradas para direcciones de wallet
-    wallet_address_1 = st.sidebar.text_input("Wallet Address 1")
-    wallet_address_2 = st.sidebar.text_input("Wallet Address 2 (opcional)")
-    wallet_address_3 = st.sidebar.text_input("Wallet Address 3 (opcional)")
+    # Entradas para direcciones de wallet: texto libre y/o CSV, sin límite
+    wallets_text = st.sidebar.text_area(
+        "Wallet Addresses",
+        help="Una dirección por línea, o separadas por comas. Sin límite de direcciones."
+    )
+    wallets_file = st.sidebar.file_uploader("O sube un CSV con direcciones", type=["csv", "txt"])
+    addresses = list(dict.fromkeys(parse_wallet_addresses(wallets_text) + read_wallets_file(wallets_file)))
+    if addresses:
+        st.sidebar.caption(f"{len(addresses)} direcciones")
+
+    force_refresh = st.sidebar.checkbox(
+        "Forzar actualización",
+        help="Vuelve a consultar todas las wallets aunque haya datos recientes en caché."
+    )
 
     # Botón para actualizar/análisis de portafolios
     if st.sidebar.button("Analizar Portafolios"):
         # Si el usuario quiere actualizar, se fuerza el análisis y se limpia el DataFrame almacenado
         st.session_state["analyze"] = True
         st.session_state["combined_df"] = None
+        st.session_state["analyses"] = {}
 
-    # Si ya existe información almacenada, se muestra directamente junto a los gráficos y métricas
-    if st.session_state["combined_df"] is not None:
-        st.info("Mostrando datos almacenados. Si deseas actualizar, haz clic en 'Analizar Portafolios'.")
-        df_display = st.session_state["combined_df"].copy()
-        df_display["balance_usd"] = df_display["balance_usd"].apply(lambda x: f"${format_number(x)}")
-        st.dataframe(df_display, use_container_width=True)
-
-        # Mostrar gráficos y métricas si hay balances
-        if st.session_state["combined_df"]['balance_usd'].sum() > 0:
-            st.subheader("Distribución de Balance USD")
-            c1, c2 = st.columns(2)
-
-            with c1:
-                df_grouped = st.session_state["combined_df"].groupby(['token_symbol','common_name'])['balance_usd'].sum().reset_index()
-                fig = px.pie(
-                    df_grouped,
-                    values='balance_usd',
-                    names=df_grouped.apply(lambda x: f"{x['token_symbol']} ({x['common_name']})", axis=1),
-                    title='Por Token/Protocolo'
-                )
-                st.plotly_chart(fig, use_container_width=True)
-
-            with c2:
-                df_grouped_mod = st.session_state["combined_df"].groupby('wallet')['balance_usd'].sum().reset_index()
-                fig2 = px.pie(
-                    df_grouped_mod,
-                    values='balance_usd',
-                    names='wallet',
-                    title='Por Wallet'
-                )
-                st.plotly_chart(fig2, use_container_width=True)
-
-            col_a, col_b, col_c = st.columns(3)
-            total_balance = st.session_state["combined_df"]['balance_usd'].sum()
-            col_a.metric("Total Balance USD", f"${format_number(total_balance)}")
-            col_b.metric("Núm. de Protocolos", len(st.session_state["combined_df"]['common_name'].unique()))
-            col_c.metric("Núm. de Posiciones", len(st.session_state["combined_df"]))
-
-        # También se mantiene el resumen del portafolio guardado (si se realizó el análisis)
-        if "portfolio_summary" in st.session_state:
-            st.subheader("Resumen del Portafolio")
-            st.text(st.session_state["portfolio_summary"])
-
-        return  # Termina la función para evitar reanálisis
+    stored = st.session_state["combined_df"] is not None
 
     # Si no hay datos almacenados y el usuario pulsó el botón, se realiza el análisis
-    if st.session_state["analyze"]:
-        wallet_dict = {
-            f"Wallet #{i+1}": addr
-            for i, addr in enumerate([wallet_address_1, wallet_address_2, wallet_address_3])
-            if addr
-        }
-
-        if not wallet_dict:
+    if not stored and st.session_state["analyze"]:
+        if not addresses:
             st.warning("Por favor, ingresa al menos una dirección de wallet.")
             return
+        combined_df = fetch_portfolio(addresses, force_refresh)
+        if combined_df is None:
+            return
+        # Guardar el DataFrame en session_state para usos futuros
+        st.session_state['combined_df'] = combined_df
 
-        combined_df = pd.DataFrame()
-        errors = []
-
-        for wallet_label, addr in wallet_dict.items():
-            result = get_user_defi_positions(addr, st.secrets["merlin_api_key"])
-            if 'error' not in result:
-                df_wallet = process_defi_data(result)
-                df_wallet['wallet'] = wallet_label
-                combined_df = pd.concat([combined_df, df_wallet], ignore_index=True)
-            else:
-                errors.append(f"Error con {wallet_label} ({addr}): {result['error']}")
-
-        if errors:
-            for err in errors:
-                st.error(err)
+    if st.session_state["combined_df"] is None:
+        return
 
-        if combined_df.empty:
-            st.warning("No se encontraron posiciones DeFi > $5 para las direcciones ingresadas.")
-            return
+    # Si ya existe información almacenada, se muestra directamente junto a los gráficos y métricas
+    if stored:
+        st.info("Mostrando datos almacenados. Si deseas actualizar, haz clic en 'Analizar Portafolios'.")
 
-        st.subheader("Tus Posiciones DeFi Combinadas")
-        df_display = combined_df.copy()
-        df_display["balance_usd"] = df_display["balance_usd"].apply(lambda x: f"${format_number(x)}")
-        columns_order = ['wallet'] + [col for col in df_display.columns if col != 'wallet']
-        df_display = df_display[columns_order]
+    combined_df = st.session_state["combined_df"]
+    st.subheader("Tus Posiciones DeFi Combinadas")
+    if render_dashboard(combined_df):
+        render_alternatives(combined_df)
+    else:
+        st.warning("No se encontraron posiciones > \$5 en las direcciones ingresadas.")
 
-        # Guardar el DataFrame en session_state para usos futuros
-        st.session_state['combined_df'] = combined_df
-        st.dataframe(df_display, use_container_width=True)
-
-        if combined_df['balance_usd'].sum() > 0:
-            st.subheader("Distribución de Balance USD")
-            c1, c2 = st.columns(2)
-
-            with c1:
-                df_grouped = combined_df.groupby(['token_symbol','common_name'])['balance_usd'].sum().reset_index()
-                fig = px.pie(
-                    df_grouped,
-                    values='balance_usd',
-                    names=df_grouped.apply(lambda x: f"{x['token_symbol']} ({x['common_name']})", axis=1),
-                    title='Por Token/Protocolo'
-                )
-                st.plotly_chart(fig, use_container_width=True)
-
-            with c2:
-                df_grouped_mod = combined_df.groupby('wallet')['balance_usd'].sum().reset_index()
-                fig2 = px.pie(
-                    df_grouped_mod,
-                    values='balance_usd',
-                    names='wallet',
-                    title='Por Wallet'
-                )
-                st.plotly_chart(fig2, use_container_width=True)
-
-            col_a, col_b, col_c = st.columns(3)
-            total_balance = combined_df['balance_usd'].sum()
-            col_a.metric("Total Balance USD", f"${format_number(total_balance)}")
-            col_b.metric("Núm. de Protocolos", len(combined_df['common_name'].unique()))
-            col_c.metric("Núm. de Posiciones", len(combined_df))
-
-            st.subheader("Alternativas de Inversión DeFi")
-            llama_data = get_defi_llama_yields()
-
-            # Guardar también el resumen del portafolio
-            st.session_state["portfolio_summary"] = summarize_portfolio(combined_df)
-
-            if 'error' not in llama_data:
-                for idx, row in combined_df.iterrows():
-                    with st.expander(f"{row['token_symbol']} en {row['common_name']}"):
-                        alternatives = get_alternatives_for_token(row['token_symbol'], llama_data)
-                        if alternatives:
-                            df_alt = pd.DataFrame(alternatives)
-                            df_alt['apy'] = df_alt['apy'].apply(lambda x: f"{x:.2f}%")
-                            df_alt['tvlUsd'] = df_alt['tvlUsd'].apply(lambda x: f"${format_number(x)}")
-                            st.dataframe(df_alt, use_container_width=True)
-                            openai_key = get_openai_api_key()
-                            analysis = generate_investment_analysis(row, alternatives, openai_key)
-                            st.markdown(f"**Análisis breve:** {analysis}")
-                        else:
-                            st.info("No se encontraron alternativas.")
-            else:
-                st.warning("No se pudo consultar DeFiLlama.")
-        else:
-            st.warning("No se encontraron posiciones > \$5 en las direcciones ingresadas.")
+    # Resumen del portafolio (memorizado por la huella de combined_df)
+    st.subheader("Resumen del Portafolio")
+    st.text(get_portfolio_summary(combined_df))
 
 def main():
     show_portfolio()
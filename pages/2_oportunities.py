@@ -1,26 +1,16 @@
 import streamlit as st
 import pandas as pd
-import requests
-import json
-import time
 import re
+from yields import get_defi_llama_yields, get_pool_store, yields_offline_notice
+from pool_filters import run_filter_pipeline
+from metrics import render_metrics, timed
+
+# Pools de mayor APY entre los que se buscan los estables
+STABLE_CANDIDATES = 50
 
 # Configuración de la página
 st.set_page_config(page_title="Crypto Portfolio DeFi Alternatives", layout="wide")
 
-# Función para consultar la API de DeFiLlama
-def get_defi_llama_yields():
-    """Consulta pools de https://yields.llama.fi/pools."""
-    url = "https://yields.llama.fi/pools"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"Error {response.status_code}: {response.text}"}
-    except Exception as e:
-        return {"error": f"Exception occurred: {str(e)}"}
-
 # Inicialización del portafolio en session_state
 if 'portfolio' not in st.session_state:
     st.session_state.portfolio = [ 
@@ -54,6 +44,7 @@ if 'context' not in st.session_state:
         'type': None,
         'min_apy': None,
         'min_tvl': None,
+        'stable': False,
         'filters': [],
         'query_history': []
     }
@@ -72,193 +63,45 @@ if 'debug_info' not in st.session_state:
         "final_count": 0
     }
 
-# Función mejorada para normalizar nombres de blockchain
-def normalize_chain_name(chain):
-    chain_mapping = {
-        'avax': 'Avalanche',
-        'avalanche': 'Avalanche',
-        'ethereum': 'Ethereum',
-        'eth': 'Ethereum',
-        'arbitrum': 'Arbitrum',
-        'arb': 'Arbitrum',
-        'optimism': 'Optimism',
-        'op': 'Optimism',
-        'polygon': 'Polygon',
-        'poly': 'Polygon',
-        'mnt': 'Mantle',
-        'mantle': 'Mantle',
-        'bsc': 'BSC',
-        'binance': 'BSC'
-    }
-    return chain_mapping.get(chain.lower(), chain.capitalize())
-
 # Función mejorada para filtrar datos de DeFiLlama con enfoque progresivo
-def filter_defi_llama_data(data, context):
-    """Filtra los resultados de DeFiLlama según el contexto actual"""
-    """Filtra los resultados de DeFiLlama de forma progresiva con diagnóstico"""
-    original_data = data.copy()
-    filtered_data = data.copy()
-    filters_applied = []
-    intermediate_counts = {"Datos originales": len(filtered_data)}
-
-    # Aplicar filtros por blockchain de manera más flexible
-    # Aplicar filtro de blockchain primero (si existe)
-    if context.get('chain'):
-        chain = normalize_chain_name(context['chain'])
-        # Más flexible: buscar subcadenas en lugar de coincidencia exacta
-        chain_matches = [p for p in filtered_data if chain.lower() in p['chain'].lower()]
-        # Si no hay coincidencias, mantener todos los datos
-        if chain_matches:
-            filtered_data = chain_matches
-        chain_filtered = [p for p in filtered_data if p['chain'].lower() == chain.lower()]
-        intermediate_counts["Después de filtrar por blockchain"] = len(chain_filtered)
-
-        # Si no hay resultados, intentar una búsqueda más flexible
-        if not chain_filtered:
-            chain_filtered = [p for p in original_data if context['chain'].lower() in p['chain'].lower()]
-            if chain_filtered:
-                filters_applied.append(f"Blockchain: contiene '{context['chain']}'")
-                intermediate_counts["Después de filtrar por blockchain (flexible)"] = len(chain_filtered)
-        else:
-            filters_applied.append(f"Blockchain: {chain}")
-
-    # Aplicar filtros por token de manera más flexible para USDC
-    if context.get('token'):
-        # Actualizar filtrados sólo si encontramos resultados
-        if chain_filtered:
-            filtered_data = chain_filtered
-
-    # Aplicar filtro de token (si existe)
-    if context.get('token') and filtered_data:
-        token = context['token'].upper()
-        # Caso especial para USDC en distintas cadenas
-        if token == "USDC":
-            token_matches = [p for p in filtered_data if
-                            any(t in p['symbol'].upper() for t in ["USDC", "USDC.E", "AXLUSDC"])]
-        token_filtered = [p for p in filtered_data if token in p['symbol'].upper()]
-        intermediate_counts["Después de filtrar por token"] = len(token_filtered)
-
-        # Si hay resultados, actualizar datos filtrados
-        if token_filtered:
-            filtered_data = token_filtered
-            filters_applied.append(f"Token: contiene '{token}'")
-        else:
-            token_matches = [p for p in filtered_data if token in p['symbol'].upper()]
-
-        # Si hay coincidencias de token, aplicar el filtro
-        if token_matches:
-            filtered_data = token_matches
-            filters_applied.append(f"Token: {token}")
-
-    # Aplicar filtros por APY mínimo
-    if context.get('min_apy') is not None:
-        filtered_data = [p for p in filtered_data if p['apy'] >= context['min_apy']]
-        filters_applied.append(f"Min APY: {context['min_apy']:.2f}%")
-
-    # Aplicar filtros por TVL mínimo
-    if context.get('min_tvl') is not None:
-        filtered_data = [p for p in filtered_data if p['tvlUsd'] >= context['min_tvl']]
-        filters_applied.append(f"Min TVL: ${context['min_tvl']:,.2f}")
-
-    # Aplicar filtros por protocolo (más flexible)
-    if context.get('protocol'):
-        protocol_matches = [p for p in filtered_data if context['protocol'].lower() in p['project'].lower()]
-        if protocol_matches:
-            filtered_data = protocol_matches
-            # Si no hay resultados, intentar una búsqueda más flexible
-            token_filtered = [p for p in filtered_data if any(token_part in p['symbol'].upper()
-                                                            for token_part in token.split('/'))]
-            if token_filtered:
-                filtered_data = token_filtered
-                filters_applied.append(f"Token: contiene parte de '{token}'")
-                intermediate_counts["Después de filtrar por token (flexible)"] = len(token_filtered)
-
-    # Aplicar filtro de protocolo (si existe)
-    if context.get('protocol') and filtered_data:
-        protocol = context['protocol'].lower()
-        protocol_filtered = [p for p in filtered_data if protocol in p['project'].lower()]
-        intermediate_counts["Después de filtrar por protocolo"] = len(protocol_filtered)
-
-        if protocol_filtered:
-            filtered_data = protocol_filtered
-            filters_applied.append(f"Protocol: {context['protocol']}")
-
-    # Aplicar filtros por tipo de manera opcional
-    if context.get('type') == 'Yield':
-        yield_matches = [p for p in filtered_data if p.get('exposure') == 'single']
-        if yield_matches:
-            filtered_data = yield_matches
-            filters_applied.append(f"Type: Yield (single exposure)")
-    elif context.get('type') == 'Liquidity Pool':
-        lp_matches = [p for p in filtered_data if p.get('exposure') != 'single']
-        if lp_matches:
-            filtered_data = lp_matches
-            filters_applied.append(f"Type: Liquidity Pool (multiple exposure)")
-    # Aplicar filtro de tipo (si existe)
-    if context.get('type') and filtered_data:
-        if context['type'] == 'Yield':
-            type_filtered = [p for p in filtered_data if p.get('exposure') == 'single']
-            intermediate_counts["Después de filtrar por tipo Yield"] = len(type_filtered)
-            if type_filtered:
-                filtered_data = type_filtered
-                filters_applied.append(f"Type: Yield (single exposure)")
-        elif context['type'] == 'Liquidity Pool':
-            type_filtered = [p for p in filtered_data if p.get('exposure') != 'single']
-            intermediate_counts["Después de filtrar por tipo Liquidity Pool"] = len(type_filtered)
-            if type_filtered:
-                filtered_data = type_filtered
-                filters_applied.append(f"Type: Liquidity Pool (multiple exposure)")
-
-    # Aplicar filtro de TVL mínimo (si existe)
-    if context.get('min_tvl') is not None and filtered_data:
-        tvl_filtered = [p for p in filtered_data if p['tvlUsd'] >= context['min_tvl']]
-        intermediate_counts["Después de filtrar por TVL mínimo"] = len(tvl_filtered)
-
-        if tvl_filtered:
-            filtered_data = tvl_filtered
-            filters_applied.append(f"Min TVL: ${context['min_tvl']:,.2f}")
-        else:
-            # Si no hay resultados, intentar con la mitad del TVL mínimo
-            relaxed_tvl = context['min_tvl'] / 2
-            tvl_filtered = [p for p in filtered_data if p['tvlUsd'] >= relaxed_tvl]
-            if tvl_filtered:
-                filtered_data = tvl_filtered
-                filters_applied.append(f"Min TVL: ${relaxed_tvl:,.2f} (reducido)")
-                intermediate_counts["Después de reducir TVL mínimo"] = len(tvl_filtered)
-
-    # Aplicar filtro de APY mínimo (si existe)
-    if context.get('min_apy') is not None and filtered_data:
-        apy_filtered = [p for p in filtered_data if p['apy'] >= context['min_apy']]
-        intermediate_counts["Después de filtrar por APY mínimo"] = len(apy_filtered)
-
-        if apy_filtered:
-            filtered_data = apy_filtered
-            filters_applied.append(f"Min APY: {context['min_apy']:.2f}%")
-        else:
-            # Si no hay resultados, intentar con la mitad del APY mínimo
-            relaxed_apy = context['min_apy'] / 2
-            apy_filtered = [p for p in filtered_data if p['apy'] >= relaxed_apy]
-            if apy_filtered:
-                filtered_data = apy_filtered
-                filters_applied.append(f"Min APY: {relaxed_apy:.2f}% (reducido)")
-                intermediate_counts["Después de reducir APY mínimo"] = len(apy_filtered)
+@timed("page.oportunities.filter")
+def filter_defi_llama_data(store, context):
+    """
+    Filtra los pools del PoolStore de forma progresiva con diagnóstico.
+    Las etapas (blockchain, token, protocolo, tipo, TVL, APY) se aplican en una
+    sola pasada y los resultados intermedios se reutilizan entre consultas: un
+    refinamiento que sólo añade o cambia las últimas etapas filtra el subconjunto
+    ya calculado en lugar de todos los pools.
+    """
+    rows, filters_applied, intermediate_counts, reused = run_filter_pipeline(store, context)
 
     # Guardar información de diagnóstico
     st.session_state.debug_info = {
         "intermediate_counts": intermediate_counts,
-        "final_count": len(filtered_data)
+        "final_count": len(rows),
+        "reused_stages": reused
     }
 
-    # Ordenar por APY descendente
-    filtered_data.sort(key=lambda x: x['apy'], reverse=True)
-
-    # Limitar a 10 resultados para mejorar visualización
-    # Limitar a 10 resultados
-    filtered_data = filtered_data[:10]
+    # Ordenar por APY descendente y limitar a 10 resultados, con la evolución
+    # del APY a 7/30 días según el histórico local (SQLAlchemy se carga aquí,
+    # no al abrir la página)
+    from yield_history import annotate_with_trends
+    if context.get('stable'):
+        # Se descartan los pools cuyo APY ha oscilado demasiado en 30 días
+        # (los que aún no tienen histórico se mantienen)
+        candidates = annotate_with_trends(store.records(store.top_by_apy(rows, STABLE_CANDIDATES)))
+        filtered_data = [alt for alt in candidates if alt['apy_stable'] is not False][:10]
+        filters_applied = [*filters_applied, "APY estable (30 días)"]
+        st.session_state.debug_info["intermediate_counts"] = {
+            **intermediate_counts, "Después de filtrar por APY estable": len(filtered_data)
+        }
+    else:
+        filtered_data = annotate_with_trends(store.records(store.top_by_apy(rows, 10)))
 
     return filtered_data, filters_applied
 
 # Función mejorada para procesar consultas del usuario
+@timed("page.oportunities.query")
 def process_user_query(query):
     """Procesa consultas del usuario, actualiza el contexto y realiza búsquedas"""
     # Añadir consulta al historial
@@ -327,6 +170,16 @@ def process_user_query(query):
             st.session_state.context['min_tvl'] = 50000  # $50K
         context_updated = True
 
+    # Detectar solicitudes de APY estable (según el histórico de yields), o de
+    # quitar ese filtro (se comprueba antes: "sin estabilidad" contiene "estabilidad")
+    if any(term in query for term in ['sin estabilidad', 'quita estabilidad', 'quitar estabilidad', 'no estable']):
+        if st.session_state.context.get('stable'):
+            st.session_state.context['stable'] = False
+            context_updated = True
+    elif any(term in query for term in ['estable', 'estabilidad', 'sin caídas', 'consistente']):
+        st.session_state.context['stable'] = True
+        context_updated = True
+
     # Si el contexto se actualizó o no hay alternativas, consultar la API
     if context_updated or not st.session_state.alternatives:
         with st.spinner('Consultando alternativas en DeFiLlama...'):
@@ -338,9 +191,13 @@ def process_user_query(query):
                 st.session_state.messages.append({"role": "assistant", "content": error_msg})
                 return
 
-            # Obtener datos y filtrar según contexto
-            data = llama_data.get("data", [])
-            filtered_data, filters_applied = filter_defi_llama_data(data, st.session_state.context)
+            offline_notice = yields_offline_notice()
+            if offline_notice:
+                st.session_state.messages.append({"role": "assistant", "content": offline_notice})
+
+            # Obtener el store columnar del snapshot y filtrar según contexto
+            store = get_pool_store(llama_data)
+            filtered_data, filters_applied = filter_defi_llama_data(store, st.session_state.context)
 
             # Guardar alternativas y filtros
             st.session_state.alternatives = filtered_data
@@ -375,6 +232,9 @@ def process_user_query(query):
                         st.session_state.debug_info["intermediate_counts"]["Después de filtrar por APY mínimo"] == 0:
                         diagnostic_msg += "\nEl APY solicitado es demasiado alto para las alternativas disponibles. Prueba sin filtrar por APY."
 
+                    elif st.session_state.debug_info["intermediate_counts"].get("Después de filtrar por APY estable") == 0:
+                        diagnostic_msg += "\nNinguna alternativa ha mantenido un APY estable en los últimos 30 días. Escribe 'sin estabilidad' para quitar este filtro."
+
                 st.session_state.messages.append({"role": "assistant", "content": diagnostic_msg})
 
 # Diseño de la interfaz de usuario
@@ -432,8 +292,11 @@ with col1:
             st.subheader("Proceso de Filtrado")
             for step, count in st.session_state.debug_info["intermediate_counts"].items():
                 st.markdown(f"**{step}:** {count} resultados")
+            if st.session_state.debug_info.get("reused_stages"):
+                st.caption(f"Etapas reutilizadas de consultas anteriores: {st.session_state.debug_info['reused_stages']}")
         else:
             st.info("No hay información de diagnóstico disponible todavía. Realiza una consulta primero.")
+        render_metrics()
 
 # Columna 2: Chat y Alternativas
 with col2:
@@ -459,6 +322,8 @@ with col2:
                 'Protocol': alt['project'],
                 'Token': alt['symbol'],
                 'APY (%)': round(alt['apy'], 2),
+                'APY media 7d (%)': None if alt.get('apy_mean_7d') is None else round(alt['apy_mean_7d'], 2),
+                'Cambio APY 30d (pp)': None if alt.get('apy_change_30d') is None else round(alt['apy_change_30d'], 2),
                 'TVL (USD)': f"${alt['tvlUsd']:,.2f}",
                 'Exposure': alt.get('exposure', 'N/A'),
                 'IL Risk': alt.get('ilRisk', 'N/A')
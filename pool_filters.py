@@ -0,0 +1,221 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics import timed
+
+# Resultados intermedios que se guardan por snapshot (prefijos de contexto)
+MAX_CACHED_PREFIXES = 256
+
+# Función mejorada para normalizar nombres de blockchain
+def normalize_chain_name(chain):
+    chain_mapping = {
+        'avax': 'Avalanche',
+        'avalanche': 'Avalanche',
+        'ethereum': 'Ethereum',
+        'eth': 'Ethereum',
+        'arbitrum': 'Arbitrum',
+        'arb': 'Arbitrum',
+        'optimism': 'Optimism',
+        'op': 'Optimism',
+        'polygon': 'Polygon',
+        'poly': 'Polygon',
+        'mnt': 'Mantle',
+        'mantle': 'Mantle',
+        'bsc': 'BSC',
+        'binance': 'BSC'
+    }
+    return chain_mapping.get(chain.lower(), chain.capitalize())
+
+
+########################################################################
+#                     ETAPAS DEL PIPELINE DE FILTROS                   #
+########################################################################
+# Cada etapa recibe las filas seleccionadas (array ordenado de índices del
+# PoolStore) y devuelve (filas, filtro aplicado o None, {paso: recuento}).
+# Trabajan sólo sobre el subconjunto recibido, nunca sobre todo el universo.
+
+def _select_codes(store, col, rows, matching_categories):
+    lookup = np.zeros(len(store.categories[col]) + 1, dtype=bool)
+    lookup[np.flatnonzero(np.asarray(matching_categories, dtype=bool))] = True
+    return rows[lookup[store.codes[col][rows]]]
+
+
+def _chain_stage(store, rows, chain_param):
+    counts = {}
+    chain = normalize_chain_name(chain_param)
+    selected = _select_codes(store, 'chain', rows, store.chain_lower == chain.lower())
+    counts["Después de filtrar por blockchain"] = len(selected)
+    if len(selected):
+        return selected, f"Blockchain: {chain}", counts
+    # Si no hay resultados, intentar una búsqueda más flexible
+    selected = _select_codes(store, 'chain', rows, store.chain_lower.str.contains(chain_param.lower(), regex=False))
+    if len(selected):
+        counts["Después de filtrar por blockchain (flexible)"] = len(selected)
+        return selected, f"Blockchain: contiene '{chain_param}'", counts
+    return rows, None, counts
+
+
+def _token_stage(store, rows, token):
+    # Los alias del índice hacen que "USDC" también cubra USDC.E y AXLUSDC
+    counts = {}
+    selected = np.intersect1d(rows, store.token_index.lookup(token), assume_unique=True)
+    counts["Después de filtrar por token"] = len(selected)
+    if len(selected):
+        return selected, f"Token: contiene '{token}'", counts
+    # Búsqueda más flexible por cada parte del par (p.ej. "CMETH/PT-CMETH")
+    selected = np.intersect1d(rows, store.token_index.lookup(token, match_all=False), assume_unique=True)
+    if len(selected):
+        counts["Después de filtrar por token (flexible)"] = len(selected)
+        return selected, f"Token: contiene parte de '{token}'", counts
+    return rows, None, counts
+
+
+def _protocol_stage(store, rows, protocol):
+    selected = _select_codes(store, 'project', rows, store.project_lower.str.contains(protocol.lower(), regex=False))
+    counts = {"Después de filtrar por protocolo": len(selected)}
+    if len(selected):
+        return selected, f"Protocol: {protocol}", counts
+    return rows, None, counts
+
+
+def _type_stage(store, rows, pool_type):
+    single = _select_codes(store, 'exposure', rows, store.categories['exposure'] == 'single')
+    if pool_type == 'Yield':
+        selected = single
+        counts = {"Después de filtrar por tipo Yield": len(selected)}
+        label = "Type: Yield (single exposure)"
+    else:
+        selected = np.setdiff1d(rows, single, assume_unique=True)
+        counts = {"Después de filtrar por tipo Liquidity Pool": len(selected)}
+        label = "Type: Liquidity Pool (multiple exposure)"
+    if len(selected):
+        return selected, label, counts
+    return rows, None, counts
+
+
+def _min_tvl_stage(store, rows, min_tvl):
+    selected = rows[store.tvl[rows] >= min_tvl]
+    counts = {"Después de filtrar por TVL mínimo": len(selected)}
+    if len(selected):
+        return selected, f"Min TVL: ${min_tvl:,.2f}", counts
+    # Si no hay resultados, intentar con la mitad del TVL mínimo
+    relaxed_tvl = min_tvl / 2
+    selected = rows[store.tvl[rows] >= relaxed_tvl]
+    if len(selected):
+        counts["Después de reducir TVL mínimo"] = len(selected)
+        return selected, f"Min TVL: ${relaxed_tvl:,.2f} (reducido)", counts
+    return rows, None, counts
+
+
+def _min_apy_stage(store, rows, min_apy):
+    selected = rows[store.apy[rows] >= min_apy]
+    counts = {"Después de filtrar por APY mínimo": len(selected)}
+    if len(selected):
+        return selected, f"Min APY: {min_apy:.2f}%", counts
+    # Si no hay resultados, intentar con la mitad del APY mínimo
+    relaxed_apy = min_apy / 2
+    selected = rows[store.apy[rows] >= relaxed_apy]
+    if len(selected):
+        counts["Después de reducir APY mínimo"] = len(selected)
+        return selected, f"Min APY: {relaxed_apy:.2f}% (reducido)", counts
+    return rows, None, counts
+
+
+def compile_filters(context):
+    """
+    Traduce el contexto de la conversación en la lista ordenada de etapas a
+    aplicar: [(clave, función, parámetro)]. Las etapas sin valor en el contexto
+    no aparecen, así que dos contextos que sólo difieren en las últimas etapas
+    comparten prefijo.
+    """
+    stages = []
+    if context.get('chain'):
+        stages.append((('chain', context['chain'].lower()), _chain_stage, context['chain']))
+    if context.get('token'):
+        token = context['token'].upper()
+        stages.append((('token', token), _token_stage, token))
+    if context.get('protocol'):
+        stages.append((('protocol', context['protocol'].lower()), _protocol_stage, context['protocol']))
+    if context.get('type') in ('Yield', 'Liquidity Pool'):
+        stages.append((('type', context['type']), _type_stage, context['type']))
+    if context.get('min_tvl') is not None:
+        stages.append((('min_tvl', float(context['min_tvl'])), _min_tvl_stage, context['min_tvl']))
+    if context.get('min_apy') is not None:
+        stages.append((('min_apy', float(context['min_apy'])), _min_apy_stage, context['min_apy']))
+    return stages
+
+
+class _PrefixCache:
+    """LRU de resultados intermedios {prefijo de etapas: (filas, filtros, recuentos)}."""
+
+    def __init__(self, max_entries=MAX_CACHED_PREFIXES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_prefix_caches_lock = threading.Lock()
+
+
+def _prefix_cache_for(store):
+    # La caché vive en el propio store: se descarta sola al cambiar de snapshot
+    cache = getattr(store, '_filter_prefix_cache', None)
+    if cache is None:
+        with _prefix_caches_lock:
+            cache = getattr(store, '_filter_prefix_cache', None)
+            if cache is None:
+                cache = _PrefixCache()
+                store._filter_prefix_cache = cache
+    return cache
+
+
+@timed("run_filter_pipeline")
+def run_filter_pipeline(store, context):
+    """
+    Aplica las etapas del contexto sobre el PoolStore en una sola pasada,
+    reutilizando el resultado del prefijo más largo ya calculado.
+    Devuelve (filas, filtros aplicados, recuentos por paso, etapas reutilizadas).
+    """
+    stages = compile_filters(context)
+    cache = _prefix_cache_for(store)
+
+    rows = np.arange(len(store), dtype=np.intp)
+    filters_applied = []
+    intermediate_counts = {"Datos originales": len(store)}
+    reused = 0
+
+    # Buscar el prefijo más largo ya calculado
+    keys = tuple(key for key, _, _ in stages)
+    for depth in range(len(stages), 0, -1):
+        entry = cache.get(keys[:depth])
+        if entry is not None:
+            rows, cached_filters, cached_counts = entry
+            filters_applied = list(cached_filters)
+            intermediate_counts = dict(cached_counts)
+            reused = depth
+            break
+
+    for depth in range(reused, len(stages)):
+        _, stage, param = stages[depth]
+        if len(rows):
+            rows, label, counts = stage(store, rows, param)
+            intermediate_counts.update(counts)
+            if label:
+                filters_applied.append(label)
+        cache.put(keys[:depth + 1], (rows, tuple(filters_applied), dict(intermediate_counts)))
+
+    return rows, filters_applied, intermediate_counts, reused
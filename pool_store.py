@@ -0,0 +1,444 @@
+import codecs
+import heapq
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+
+# Campos de cada pool de DeFiLlama que usa la aplicación ('pool' es el id
+# estable del pool, clave del histórico de yields)
+POOL_FIELDS = ['pool', 'symbol', 'project', 'chain', 'apy', 'tvlUsd', 'exposure', 'ilRisk']
+CATEGORICAL_FIELDS = ['pool', 'symbol', 'project', 'chain', 'exposure', 'ilRisk']
+NUMERIC_FIELDS = ['apy', 'tvlUsd']
+
+# Variantes de un mismo activo que deben resolverse juntas al buscar alternativas
+TOKEN_ALIASES = {
+    'USDC.E': 'USDC',
+    'USDCE': 'USDC',
+    'AXLUSDC': 'USDC',
+    'WETH': 'ETH',
+    'WETH.E': 'ETH',
+}
+
+# Prefijos de envoltorio (Pendle PT/YT/SY, LP) que no identifican un activo:
+# 'PT-cmETH' debe buscarse como 'CMETH', no como 'PT'
+GENERIC_TOKEN_PARTS = {'PT', 'YT', 'SY', 'LP'}
+# Longitud mínima de un fragmento para indexarlo como token ('USDC.E' no indexa 'E')
+MIN_TOKEN_LENGTH = 2
+
+# Antigüedad (s) a partir de la cual un snapshot que no es el actual ni el
+# anterior se considera huérfano (proceso que murió a mitad de guardarlo) y
+# se borra; antes puede ser uno que otro proceso está escribiendo todavía
+SNAPSHOT_GRACE_SECONDS = 3600
+
+_SYMBOL_SEPARATORS = re.compile(r'[-/.]')
+
+
+def split_symbol(symbol):
+    """
+    Partes distintas de un símbolo de posición o pool separadas por '-' o '/',
+    sin los prefijos genéricos (salvo que el símbolo sólo tenga esos):
+    'cmETH/PT-cmETH' -> ['CMETH'].
+    """
+    parts = list(dict.fromkeys(part for part in re.split(r'[-/]', symbol.upper()) if part))
+    specific = [part for part in parts if part not in GENERIC_TOKEN_PARTS]
+    return specific or parts
+
+
+def normalize_token(token):
+    """Símbolo canónico de un token (mayúsculas y tabla de alias)."""
+    token = token.strip().upper()
+    return TOKEN_ALIASES.get(token, token)
+
+
+def symbol_constituents(symbol):
+    """
+    Tokens que componen el símbolo de un pool, ya normalizados.
+    'WSTETH-STETH' -> {'WSTETH', 'STETH'}; 'USDC.E/WETH' -> {'USDC', 'ETH'}
+    """
+    parts = set()
+    for chunk in split_symbol(symbol):
+        # 'USDC.E' se indexa como alias completo y por cada fragmento con
+        # longitud de ticker
+        parts.add(normalize_token(chunk))
+        parts.update(
+            token for token in (normalize_token(piece) for piece in _SYMBOL_SEPARATORS.split(chunk))
+            if len(token) >= MIN_TOKEN_LENGTH and token not in GENERIC_TOKEN_PARTS
+        )
+    return parts
+
+
+class TokenIndex:
+    """
+    Índice invertido token -> filas del PoolStore, construido una vez por snapshot.
+    Se recorre sólo la lista de símbolos únicos (categorías), no los pools, y la
+    búsqueda cuesta O(coincidencias).
+    """
+
+    def __init__(self, symbol_categories, symbol_codes):
+        order = np.argsort(symbol_codes, kind='stable')
+        bounds = np.searchsorted(symbol_codes[order], np.arange(len(symbol_categories) + 1))
+        codes_by_token = {}
+        for code, symbol in enumerate(symbol_categories):
+            for token in symbol_constituents(symbol):
+                codes_by_token.setdefault(token, []).append(code)
+        self._rows = {}
+        for token, codes in codes_by_token.items():
+            rows = np.concatenate([order[bounds[c]:bounds[c + 1]] for c in codes])
+            rows.sort()
+            self._rows[token] = rows
+
+    def __contains__(self, token):
+        return normalize_token(token) in self._rows
+
+    def tokens(self):
+        return self._rows.keys()
+
+    def rows(self, token):
+        """Filas cuyo símbolo contiene el token canónico (array vacío si no existe)."""
+        return self._rows.get(normalize_token(token), np.empty(0, dtype=np.intp))
+
+    def lookup(self, symbol, match_all=True):
+        """
+        Filas que contienen los componentes de `symbol` ('ETH', 'WSTETH-STETH',
+        'cmETH/PT-cmETH'): todos si match_all, o cualquiera de ellos.
+        """
+        parts = split_symbol(symbol)
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        result = self.rows(parts[0])
+        for part in parts[1:]:
+            if match_all:
+                result = np.intersect1d(result, self.rows(part), assume_unique=True)
+            else:
+                result = np.union1d(result, self.rows(part))
+        return result
+
+
+class ProjectedColumns:
+    """
+    Acumula sólo los campos de POOL_FIELDS de cada pool, en una lista por campo.
+    Las cadenas repetidas (chain, project, exposure...) se internan para que
+    todos los pools compartan el mismo objeto.
+    """
+
+    def __init__(self):
+        self.columns = {col: [] for col in POOL_FIELDS}
+        self.skipped = 0
+        self._interned = {}
+
+    def add(self, pool):
+        if not isinstance(pool, dict):
+            self.skipped += 1
+            return
+        interned = self._interned
+        for col in CATEGORICAL_FIELDS:
+            value = pool.get(col)
+            value = '' if value is None else str(value)
+            self.columns[col].append(interned.setdefault(value, value))
+        for col in NUMERIC_FIELDS:
+            try:
+                self.columns[col].append(float(pool.get(col)))
+            except (TypeError, ValueError):
+                self.columns[col].append(np.nan)
+
+
+def iter_json_array(chunks, key='data'):
+    """
+    Decodifica de forma incremental los elementos del array `key` de un objeto
+    JSON recibido por trozos de bytes (p.ej. response.iter_content()).
+    Sólo mantiene en memoria el trozo actual y el elemento que se está leyendo.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    marker = f'"{key}"'
+    buf = ''
+    in_array = False
+    for chunk in chunks:
+        buf += text.decode(chunk)
+        if not in_array:
+            start = buf.find(marker)
+            bracket = buf.find('[', start + len(marker)) if start >= 0 else -1
+            if bracket < 0:
+                # Conservar el final por si la clave quedó partida entre trozos
+                buf = buf[-(len(marker) + 16):] if start < 0 else buf
+                continue
+            buf = buf[bracket + 1:]
+            in_array = True
+        pos = 0
+        size = len(buf)
+        while True:
+            while pos < size and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= size:
+                break
+            if buf[pos] == ']':
+                return
+            try:
+                item, pos_end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # elemento incompleto: esperar al siguiente trozo
+            yield item
+            pos = pos_end
+        buf = buf[pos:]
+    if in_array:
+        raise ValueError("Respuesta JSON truncada: el array no se cerró")
+    raise ValueError(f"La respuesta JSON no contiene la clave '{key}'")
+
+
+class PoolStore:
+    """
+    Representación columnar de un snapshot de pools de DeFiLlama.
+    Se construye una única vez por snapshot: apy/tvlUsd como arrays float64 y
+    pool/symbol/chain/project/exposure/ilRisk como códigos categóricos, con las
+    categorías ya normalizadas (mayúsculas/minúsculas) para que los filtros
+    sean máscaras vectorizadas sin recorrer los pools en Python.
+    """
+
+    def __init__(self, apy, tvl, codes, categories, fetched_at=None, validators=None):
+        self.size = len(apy)
+        self.apy = apy
+        self.tvl = tvl
+        self.codes = codes
+        self.categories = categories
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        # ETag / Last-Modified de la respuesta de la que sale el snapshot (revalidación)
+        self.validators = validators
+        self._category_values = {col: self.categories[col].to_numpy(dtype=object) for col in CATEGORICAL_FIELDS}
+        self.chain_lower = self.categories['chain'].str.lower()
+        self.project_lower = self.categories['project'].str.lower()
+        self.token_index = TokenIndex(self.categories['symbol'], self.codes['symbol'])
+        self._top_by_token = {}
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Construye el store a partir de columnas ya proyectadas ({campo: lista})."""
+        codes, categories = {}, {}
+        for col in CATEGORICAL_FIELDS:
+            categorical = pd.Categorical(columns[col])
+            codes[col] = categorical.codes
+            categories[col] = categorical.categories
+        numeric = {col: np.nan_to_num(np.asarray(columns[col], dtype=np.float64), nan=0.0) for col in NUMERIC_FIELDS}
+        return cls(numeric['apy'], numeric['tvlUsd'], codes, categories)
+
+    @classmethod
+    def from_pools(cls, pools):
+        """Construye el store a partir de la lista de pools ('data' de la respuesta)."""
+        columns = ProjectedColumns()
+        for pool in pools or []:
+            columns.add(pool)
+        return cls.from_columns(columns.columns)
+
+    @classmethod
+    def from_stream(cls, chunks):
+        """
+        Construye el store leyendo la respuesta de /pools por trozos (bytes),
+        sin materializar nunca la lista completa de pools como dicts.
+        """
+        columns = ProjectedColumns()
+        for pool in iter_json_array(chunks, key='data'):
+            columns.add(pool)
+        return cls.from_columns(columns.columns)
+
+    @classmethod
+    def from_llama(cls, llama_data):
+        """Construye el store a partir de la respuesta completa de get_defi_llama_yields."""
+        if not llama_data or 'data' not in llama_data:
+            return cls.from_pools([])
+        if isinstance(llama_data['data'], cls):
+            return llama_data['data']
+        return cls.from_pools(llama_data['data'])
+
+    def __len__(self):
+        return self.size
+
+    ####################################################################
+    #                          PERSISTENCIA                            #
+    ####################################################################
+
+    # Formato en disco: un directorio por snapshot con un .npy por columna
+    # (cargados con mmap) y un JSON con las categorías y metadatos. El fichero
+    # CURRENT apunta al último snapshot completo y se reemplaza atómicamente.
+    SNAPSHOT_FORMAT = 2
+
+    def save(self, root):
+        """Guarda el snapshot en `root` sin dejar nunca un snapshot a medias visible."""
+        os.makedirs(root, exist_ok=True)
+        name = f"snapshot-{int(self.fetched_at)}-{uuid.uuid4().hex[:8]}"
+        target = os.path.join(root, name)
+        os.makedirs(target)
+        np.save(os.path.join(target, 'apy.npy'), self.apy)
+        np.save(os.path.join(target, 'tvlUsd.npy'), self.tvl)
+        for col in CATEGORICAL_FIELDS:
+            np.save(os.path.join(target, f'{col}.codes.npy'), self.codes[col])
+        meta = {
+            'format': self.SNAPSHOT_FORMAT,
+            'fetched_at': self.fetched_at,
+            'size': self.size,
+            'validators': self.validators,
+            'categories': {col: self.categories[col].tolist() for col in CATEGORICAL_FIELDS},
+        }
+        with open(os.path.join(target, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        pointer = os.path.join(root, 'CURRENT')
+        try:
+            with open(pointer, encoding='utf-8') as f:
+                previous = f.read().strip()
+        except OSError:
+            previous = None
+        tmp_pointer = f"{pointer}.{uuid.uuid4().hex[:8]}"
+        with open(tmp_pointer, 'w', encoding='utf-8') as f:
+            f.write(name)
+        os.replace(tmp_pointer, pointer)
+
+        # Borrar el snapshot al que apuntaba CURRENT y los huérfanos antiguos
+        # (los ya mapeados siguen siendo válidos en POSIX). Nunca uno reciente:
+        # otro proceso puede estar escribiéndolo
+        for entry in os.listdir(root):
+            if not entry.startswith('snapshot-') or entry == name:
+                continue
+            path = os.path.join(root, entry)
+            if entry == previous or self._is_stale_snapshot(path):
+                shutil.rmtree(path, ignore_errors=True)
+        return target
+
+    def _is_stale_snapshot(self, path):
+        """Snapshot anterior a éste y sin modificar desde hace SNAPSHOT_GRACE_SECONDS."""
+        try:
+            fetched_at = int(os.path.basename(path).split('-')[1])
+            modified = os.path.getmtime(path)
+        except (IndexError, ValueError, OSError):
+            return False
+        return fetched_at <= self.fetched_at and time.time() - modified > SNAPSHOT_GRACE_SECONDS
+
+    @classmethod
+    def load(cls, root):
+        """Carga con mmap el último snapshot guardado en `root`, o None si no hay."""
+        try:
+            with open(os.path.join(root, 'CURRENT'), encoding='utf-8') as f:
+                target = os.path.join(root, f.read().strip())
+            with open(os.path.join(target, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != cls.SNAPSHOT_FORMAT:
+                return None
+            apy = np.load(os.path.join(target, 'apy.npy'), mmap_mode='r')
+            tvl = np.load(os.path.join(target, 'tvlUsd.npy'), mmap_mode='r')
+            codes = {col: np.load(os.path.join(target, f'{col}.codes.npy'), mmap_mode='r') for col in CATEGORICAL_FIELDS}
+        except (OSError, ValueError, KeyError):
+            # Sin snapshot, formato dañado o reemplazado por otro proceso a mitad de lectura
+            return None
+        categories = {col: pd.Index(meta['categories'][col], dtype=object) for col in CATEGORICAL_FIELDS}
+        return cls(apy, tvl, codes, categories, fetched_at=meta['fetched_at'], validators=meta.get('validators'))
+
+    ####################################################################
+    #                             MÁSCARAS                             #
+    ####################################################################
+
+    def all(self):
+        return np.ones(self.size, dtype=bool)
+
+    def _category_mask(self, col, matching_categories):
+        """Convierte un array booleano sobre categorías en una máscara sobre pools."""
+        matched_codes = np.flatnonzero(np.asarray(matching_categories, dtype=bool))
+        if len(matched_codes) == 0:
+            return np.zeros(self.size, dtype=bool)
+        lookup = np.zeros(len(self.categories[col]) + 1, dtype=bool)
+        lookup[matched_codes] = True
+        # El código -1 (nulo) cae en la última posición, siempre False
+        return lookup[self.codes[col]]
+
+    def chain_mask(self, chain, exact=True):
+        chain = chain.lower()
+        if exact:
+            return self._category_mask('chain', self.chain_lower == chain)
+        return self._category_mask('chain', self.chain_lower.str.contains(chain, regex=False))
+
+    def project_mask(self, protocol):
+        return self._category_mask('project', self.project_lower.str.contains(protocol.lower(), regex=False))
+
+    def rows_mask(self, rows):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def token_mask(self, symbol, match_all=True):
+        """Pools que contienen los tokens de `symbol` según el índice invertido."""
+        return self.rows_mask(self.token_index.lookup(symbol, match_all=match_all))
+
+    def exposure_mask(self, exposure):
+        return self._category_mask('exposure', self.categories['exposure'] == exposure)
+
+    def min_apy_mask(self, min_apy):
+        return self.apy >= min_apy
+
+    def min_tvl_mask(self, min_tvl):
+        return self.tvl >= min_tvl
+
+    ####################################################################
+    #                            RANKING                               #
+    ####################################################################
+
+    def top_by_apy(self, mask_or_idx, n):
+        """Índices de los n pools con mayor APY dentro de la selección, ordenados desc."""
+        idx = np.asarray(mask_or_idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        if n is None or n >= len(idx):
+            return idx[np.argsort(-self.apy[idx], kind='stable')]
+        if n <= 0:
+            return idx[:0]
+        part = np.argpartition(-self.apy[idx], n - 1)[:n]
+        top = idx[part]
+        return top[np.argsort(-self.apy[top], kind='stable')]
+
+    def top_for_token(self, token, n):
+        """Top-n por APY de los pools que contienen un token; memorizado por snapshot."""
+        key = (normalize_token(token), n)
+        top = self._top_by_token.get(key)
+        if top is None:
+            top = self.top_by_apy(self.token_index.rows(token), n)
+            self._top_by_token[key] = top
+        return top
+
+    def top_alternatives(self, symbols, n):
+        """
+        Top-n alternativas para varios símbolos de posición a la vez.
+        Devuelve {símbolo: array de filas}. Cada símbolo distinto se resuelve una
+        sola vez combinando los top-n ya calculados de sus tokens (el top-n de la
+        unión está contenido en la unión de los top-n), sin ordenar todos los
+        pools que coinciden.
+        """
+        result = {}
+        for symbol in dict.fromkeys(symbols):
+            parts = split_symbol(symbol)
+            if len(parts) == 1:
+                result[symbol] = self.top_for_token(parts[0], n)
+                continue
+            candidates = set()
+            for part in parts:
+                candidates.update(self.top_for_token(part, n).tolist())
+            best = heapq.nlargest(n, sorted(candidates), key=lambda row: self.apy[row])
+            result[symbol] = np.asarray(best, dtype=np.intp)
+        return result
+
+    def column(self, col):
+        """Columna completa (todos los pools) como array: float64 o de objetos."""
+        if col in NUMERIC_FIELDS:
+            return np.asarray(self.apy if col == 'apy' else self.tvl)
+        return self._category_values[col][self.codes[col]]
+
+    def records(self, idx, fields=POOL_FIELDS):
+        """Materializa como lista de dicts sólo las filas seleccionadas."""
+        idx = np.asarray(idx)
+        columns = {}
+        for col in fields:
+            if col in NUMERIC_FIELDS:
+                columns[col] = (self.apy if col == 'apy' else self.tvl)[idx].tolist()
+            else:
+                columns[col] = self._category_values[col][self.codes[col][idx]].tolist()
+        return [dict(zip(fields, values)) for values in zip(*(columns[col] for col in fields))]
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from metrics import timed
+
+# Agregados distintos que se guardan (uno por versión de combined_df)
+MAX_CACHED_DASHBOARDS = 64
+
+_lock = threading.Lock()
+_dashboards = OrderedDict()
+_figures = OrderedDict()
+_fingerprints = {}
+
+
+def format_numbers(values):
+    """
+    Versión vectorizada de positions.format_number para una columna entera:
+    6 decimales sin ceros finales, o separadores de miles y 2 decimales a
+    partir de un millón.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    text = np.char.mod('%.6f', values).astype(object)
+    large = np.abs(values) >= 1e6
+    if large.any():
+        text[large] = [f"{v:,.2f}" for v in values[large]]
+    return pd.Series(text, dtype=object).str.rstrip('0').str.rstrip('.').to_numpy(dtype=object)
+
+
+def dataframe_fingerprint(df):
+    """
+    Huella del contenido de un DataFrame (columnas, índice y valores).
+    Para el mismo objeto se calcula una sola vez: combined_df no se modifica
+    in situ, se reemplaza entero en session_state.
+    """
+    key = id(df)
+    with _lock:
+        entry = _fingerprints.get(key)
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+    digest = hashlib.sha1()
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    fingerprint = digest.hexdigest()
+    with _lock:
+        _fingerprints[key] = (weakref.ref(df, lambda _, key=key: _fingerprints.pop(key, None)), fingerprint)
+    return fingerprint
+
+
+@timed("compute_dashboard")
+def compute_dashboard(df):
+    """
+    Calcula de una vez todos los agregados del dashboard del portafolio:
+    totales, agrupaciones por token/protocolo y por wallet con sus etiquetas, y
+    la tabla de posiciones con el balance ya formateado.
+    """
+    balances = df['balance_usd'].to_numpy(dtype=np.float64)
+    by_token = df.groupby(['token_symbol', 'common_name'], sort=False, observed=True)['balance_usd'].sum().reset_index()
+    by_token['label'] = by_token['token_symbol'].astype(str) + " (" + by_token['common_name'].astype(str) + ")"
+    by_wallet = (
+        df.groupby('wallet', sort=False, observed=True)['balance_usd'].sum().reset_index()
+        if 'wallet' in df.columns else pd.DataFrame(columns=['wallet', 'balance_usd'])
+    )
+
+    columns = (['wallet'] if 'wallet' in df.columns else []) + [c for c in df.columns if c != 'wallet']
+    display = df[columns].copy()
+    display['balance_usd'] = "$" + format_numbers(balances)
+
+    return {
+        'total_balance': float(balances.sum()),
+        'num_protocols': int(df['common_name'].nunique()),
+        'num_positions': len(df),
+        'by_token': by_token,
+        'by_wallet': by_wallet,
+        'display': display,
+    }
+
+
+def get_dashboard(df):
+    """compute_dashboard memorizado por la huella de df (compartido entre sesiones)."""
+    fingerprint = dataframe_fingerprint(df)
+    with _lock:
+        dashboard = _dashboards.get(fingerprint)
+        if dashboard is not None:
+            _dashboards.move_to_end(fingerprint)
+            return dashboard
+    dashboard = compute_dashboard(df)
+    with _lock:
+        _dashboards[fingerprint] = dashboard
+        while len(_dashboards) > MAX_CACHED_DASHBOARDS:
+            _dashboards.popitem(last=False)
+    return dashboard
+
+
+def get_dashboard_figures(df):
+    """
+    Gráficos de tarta (por token/protocolo y por wallet) del dashboard de df,
+    memorizados por su huella en una caché propia: el dict de get_dashboard
+    es compartido entre sesiones y no se modifica.
+    """
+    fingerprint = dataframe_fingerprint(df)
+    with _lock:
+        figures = _figures.get(fingerprint)
+        if figures is not None:
+            _figures.move_to_end(fingerprint)
+            return figures
+    import plotly.express as px  # sólo al pintar los gráficos por primera vez
+    dashboard = get_dashboard(df)
+    figures = (
+        px.pie(dashboard['by_token'], values='balance_usd', names='label', title='Por Token/Protocolo'),
+        px.pie(dashboard['by_wallet'], values='balance_usd', names='wallet', title='Por Wallet'),
+    )
+    with _lock:
+        _figures[fingerprint] = figures
+        while len(_figures) > MAX_CACHED_DASHBOARDS:
+            _figures.popitem(last=False)
+    return figures
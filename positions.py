@@ -0,0 +1,336 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from http_client import http_get
+from metrics import increment, timed
+from portfolio_aggregates import dataframe_fingerprint, format_numbers
+
+# Endpoint de posiciones de Merlin (configurable para apuntar a un servidor de pruebas)
+MERLIN_API_URL = os.environ.get("MERLIN_API_URL", "https://api-v1.mymerlin.io/api/merlin/public/userDeFiPositions/all")
+# Máximo de wallets consultadas en paralelo contra Merlin
+MAX_WALLET_WORKERS = int(os.environ.get("MAX_WALLET_WORKERS", 8))
+# Segundos que las posiciones de una dirección se reutilizan entre sesiones
+POSITIONS_TTL = float(os.environ.get("POSITIONS_TTL", 300))
+# Direcciones distintas que se guardan como máximo (se expulsan las menos usadas)
+POSITIONS_CACHE_MAX_ENTRIES = int(os.environ.get("POSITIONS_CACHE_MAX_ENTRIES", 1000))
+# Posiciones detalladas en el resumen del portafolio por defecto; el resto se agrega
+PORTFOLIO_SUMMARY_TOP_K = int(os.environ.get("PORTFOLIO_SUMMARY_TOP_K", 25))
+# Niveles de detalle del resumen: posiciones listadas una a una (None = todas)
+SUMMARY_DETAIL_LEVELS = {'full': None, 'standard': PORTFOLIO_SUMMARY_TOP_K, 'brief': 5, 'totals': 0}
+# Resúmenes distintos que se guardan (por versión del DataFrame y nivel de detalle)
+MAX_CACHED_SUMMARIES = 256
+
+_summaries_lock = threading.Lock()
+_summaries = OrderedDict()
+
+def format_number(value):
+    """Formatea números grandes con separadores o sufijos."""
+    if abs(value) >= 1e6:
+        return f"{value:,.2f}".rstrip('0').rstrip('.')
+    else:
+        return f"{value:.6f}".rstrip('0').rstrip('.')
+
+@timed("summarize_portfolio")
+def summarize_portfolio(df, detail='standard', top_k=None):
+    """
+    Recibe un DataFrame con columnas:
+      ['chain', 'common_name', 'module', 'token_symbol', 'balance_usd']
+    Devuelve un string describiendo sucintamente las posiciones del usuario:
+    balance total, totales exactos por protocolo, las posiciones de mayor
+    balance y el resto agregado en una línea. `detail` es una clave de
+    SUMMARY_DETAIL_LEVELS; top_k, si se indica, fija directamente cuántas
+    posiciones se detallan (None = todas).
+    """
+    if df.empty:
+        return "El portafolio está vacío o no hay posiciones mayores a \$5."
+    if top_k is None:
+        top_k = SUMMARY_DETAIL_LEVELS[detail]
+
+    balances = df['balance_usd'].to_numpy(dtype=np.float64)
+    total_balance = balances.sum()
+
+    by_protocol = (
+        df.groupby('common_name', sort=False, observed=True)['balance_usd'].sum()
+        .sort_values(ascending=False, kind='stable')
+    )
+    protocol_lines = " - " + by_protocol.index.astype(str).to_numpy(dtype=object) + ": $" + format_numbers(by_protocol.to_numpy())
+
+    # Posiciones de mayor balance (orden estable ante empates)
+    order = np.argsort(-balances, kind='stable')
+    detailed = order if top_k is None else order[:top_k]
+    tokens = df['token_symbol'].astype(str).to_numpy(dtype=object)[detailed]
+    protocols = df['common_name'].astype(str).to_numpy(dtype=object)[detailed]
+    position_lines = " • " + tokens + " en " + protocols + " con balance de $" + format_numbers(balances[detailed])
+
+    summary_lines = [
+        f"Balance total estimado: ${format_number(total_balance)}\n",
+        "Resumen por Protocolo:",
+        *protocol_lines,
+        "\nPosiciones detalladas (token/protocolo):",
+        *position_lines,
+    ]
+    if len(detailed) < len(df):
+        rest = order[len(detailed):]
+        rest_protocols = df['common_name'].iloc[rest].nunique()
+        summary_lines.append(
+            f" • Otras {len(rest)} posiciones en {rest_protocols} protocolos con balance conjunto "
+            f"de ${format_number(balances[rest].sum())}"
+        )
+
+    return "\n".join(summary_lines)
+
+def get_portfolio_summary(df, detail='standard', top_k=None):
+    """
+    summarize_portfolio memorizado por la huella de df (compartido entre
+    sesiones), para no reconstruirlo en cada rerun ni en cada mensaje del chat.
+    """
+    key = (dataframe_fingerprint(df), detail, top_k)
+    with _summaries_lock:
+        summary = _summaries.get(key)
+        if summary is not None:
+            _summaries.move_to_end(key)
+            increment("positions.summary.cache_hit")
+            return summary
+    summary = summarize_portfolio(df, detail=detail, top_k=top_k)
+    with _summaries_lock:
+        _summaries[key] = summary
+        while len(_summaries) > MAX_CACHED_SUMMARIES:
+            _summaries.popitem(last=False)
+    return summary
+
+def get_user_defi_positions(address, api_key=None):
+    """
+    Llama a la API de Merlin (o la tuya) para obtener posiciones DeFi de un usuario.
+    Retorna un objeto JSON con la información o un dict con 'error'.
+    Si no se pasa api_key se usa la de st.secrets.
+    """
+    if not api_key:
+        import streamlit as st
+        api_key = st.secrets["merlin_api_key"]
+    url = f"{MERLIN_API_URL}/{address}"
+    headers = {"Authorization": f"{api_key}"}
+
+    result = http_get(url, "merlin.positions", headers=headers)
+    return result["data"] if "error" not in result else result
+
+class PositionsCache:
+    """
+    Caché de posiciones de Merlin por dirección, compartida por todas las
+    sesiones del proceso, con TTL y expulsión LRU. Sólo se guardan respuestas
+    correctas, y si varias sesiones piden a la vez la misma dirección se hace
+    una única llamada.
+    """
+
+    def __init__(self, ttl=POSITIONS_TTL, max_entries=POSITIONS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(address):
+        return address.strip().lower()
+
+    def get(self, address):
+        """(resultado, fecha) si la dirección está en caché y fresca, o None."""
+        key = self._key(address)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def fetch(self, address, fetcher):
+        """Llama a fetcher() para la dirección, compartiendo la llamada si ya hay una en curso."""
+        key = self._key(address)
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+        if not owner:
+            return future.result()
+        result = None
+        try:
+            try:
+                result = fetcher()
+            except Exception as e:
+                result = {"error": f"Exception occurred: {str(e)}"}
+            # Sólo se guardan respuestas correctas (las listas de Merlin o dicts sin 'error')
+            if result is not None and not (isinstance(result, dict) and 'error' in result):
+                with self._lock:
+                    self._entries[key] = (result, time.time())
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        finally:
+            # Pase lo que pase, las peticiones que esperan esta dirección se liberan
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_result(result)
+        return result
+
+    def invalidate(self, address=None):
+        with self._lock:
+            if address is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(address), None)
+
+positions_cache = PositionsCache()
+
+def parse_wallet_addresses(text):
+    """
+    Extrae direcciones de un texto libre (una por línea, o separadas por comas,
+    punto y coma o espacios), sin duplicados y en el orden en que aparecen.
+    """
+    if not text:
+        return []
+    tokens = re.split(r'[\s,;]+', text)
+    return list(dict.fromkeys(token.strip().strip('"\'') for token in tokens if token.strip().strip('"\'')))
+
+# Columnas de un CSV de wallets que se reconocen como dirección
+ADDRESS_COLUMNS = ['address', 'wallet', 'direccion', 'dirección']
+
+def read_wallet_addresses(source):
+    """
+    Direcciones de un CSV/TXT (ruta o fichero abierto): la columna
+    address/wallet/direccion si la primera fila es una cabecera, o la primera.
+    """
+    try:
+        df = pd.read_csv(source, dtype=str, header=None, skip_blank_lines=True)
+    except pd.errors.EmptyDataError:
+        return []
+    if df.empty:
+        return []
+    first_row = [str(v).strip().lower() for v in df.iloc[0]]
+    column = 0
+    for name in ADDRESS_COLUMNS:
+        if name in first_row:
+            column = first_row.index(name)
+            df = df.iloc[1:]
+            break
+    return parse_wallet_addresses("\n".join(df.iloc[:, column].dropna().astype(str)))
+
+def get_positions_for_wallets(wallet_dict, api_key, max_workers=MAX_WALLET_WORKERS, force_refresh=False):
+    """
+    Consulta en paralelo las posiciones de varias wallets ({etiqueta: dirección}).
+    Devuelve {etiqueta: resultado de get_user_defi_positions} en el mismo orden;
+    la latencia total es la de la wallet más lenta, no la suma.
+    Las direcciones consultadas hace menos de POSITIONS_TTL segundos (por
+    cualquier sesión) se sirven desde positions_cache salvo con force_refresh.
+    """
+    if not wallet_dict:
+        return {}
+    results = {}
+    stale = {}
+    for label, addr in wallet_dict.items():
+        entry = None if force_refresh else positions_cache.get(addr)
+        if entry is not None:
+            increment("merlin.positions.cache_hit")
+            results[label] = entry[0]
+        else:
+            stale[label] = addr
+
+    if stale:
+        workers = max(1, min(max_workers, len(stale)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="merlin") as executor:
+            futures = {
+                label: executor.submit(positions_cache.fetch, addr, lambda addr=addr: get_user_defi_positions(addr, api_key))
+                for label, addr in stale.items()
+            }
+            for label, future in futures.items():
+                results[label] = future.result()
+    return {label: results[label] for label in wallet_dict}
+
+POSITION_COLUMNS = ['chain', 'common_name', 'module', 'token_symbol', 'balance_usd']
+# Balance mínimo (USD) para que una posición aparezca en el portafolio
+MIN_POSITION_USD = 5
+
+def _empty_positions_df(skipped=0):
+    df = pd.DataFrame({col: pd.Series(dtype='float64' if col == 'balance_usd' else 'object') for col in POSITION_COLUMNS})
+    df.attrs['skipped'] = skipped
+    return df
+
+@timed("process_defi_data")
+def process_defi_data(result):
+    """
+    Procesa la respuesta de get_user_defi_positions y la convierte en un DataFrame.
+    Filtra sólo balances > $5.
+    Recorre el payload una sola vez rellenando columnas (no dicts por fila) y
+    descarta los balances pequeños durante el recorrido. El número de entradas
+    mal formadas que se han saltado queda en df.attrs['skipped'].
+    """
+    if not result or not isinstance(result, list):
+        return _empty_positions_df()
+
+    chains, names, modules, symbols, balances = [], [], [], [], []
+    skipped = 0
+
+    def add(chain, common_name, module, symbol, balance):
+        if balance > MIN_POSITION_USD:  # Filtrar balances mínimos (NaN nunca pasa)
+            chains.append(chain)
+            names.append(common_name)
+            modules.append(module)
+            symbols.append(symbol)
+            balances.append(balance)
+
+    for protocol in result:
+        if not isinstance(protocol, dict):
+            skipped += 1
+            continue
+        chain = str(protocol.get('chain', ''))
+        common_name = str(protocol.get('commonName', ''))
+
+        for portfolio in protocol.get('portfolio') or []:
+            if not isinstance(portfolio, dict):
+                skipped += 1
+                continue
+            module = str(portfolio.get('module', ''))
+            detailed = portfolio.get('detailed')
+            if not isinstance(detailed, dict) or 'supply' not in detailed:
+                continue
+            supply_tokens = detailed['supply']
+            if not isinstance(supply_tokens, list):
+                continue
+
+            # caso Liquidity Pool
+            if module == 'Liquidity Pool' and len(supply_tokens) >= 2:
+                try:
+                    token_0, token_1 = supply_tokens[0], supply_tokens[1]
+                    balance = float(token_0.get('balanceUSD', 0)) + float(token_1.get('balanceUSD', 0))
+                    symbol = f"{token_0.get('tokenSymbol', '')}/{token_1.get('tokenSymbol', '')}"
+                except (AttributeError, TypeError, ValueError):
+                    skipped += 1
+                    continue
+                add(chain, common_name, module, symbol, balance)
+            else:
+                for token in supply_tokens:
+                    try:
+                        balance = float(token.get('balanceUSD', 0))
+                        symbol = str(token.get('tokenSymbol', ''))
+                    except (AttributeError, TypeError, ValueError):
+                        skipped += 1
+                        continue
+                    add(chain, common_name, module, symbol, balance)
+
+    if not balances:
+        return _empty_positions_df(skipped)
+
+    df = pd.DataFrame({
+        'chain': chains,
+        'common_name': names,
+        'module': modules,
+        'token_symbol': symbols,
+        'balance_usd': np.round(np.asarray(balances, dtype=np.float64), 6),
+    })
+    df.attrs['skipped'] = skipped
+    return df
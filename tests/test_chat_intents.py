@@ -0,0 +1,44 @@
+import pytest
+
+from chat_intents import parse_alternatives_request
+from pool_store import PoolStore
+
+
+def _pool(pool, symbol, chain, project, apy=5.0, tvl=1_000_000):
+    return {'pool': pool, 'symbol': symbol, 'chain': chain, 'project': project, 'apy': apy, 'tvlUsd': tvl,
+            'exposure': 'single', 'ilRisk': 'no'}
+
+
+@pytest.fixture(scope='module')
+def store():
+    return PoolStore.from_pools([
+        _pool('p1', 'ETH', 'Ethereum', 'lido'),
+        _pool('p2', 'WETH', 'Arbitrum', 'aave-v3'),
+        _pool('p3', 'ARB', 'Arbitrum', 'aave-v3'),
+        _pool('p4', 'OP', 'Optimism', 'velodrome-v2'),
+        _pool('p5', 'USDC', 'Optimism', 'aave-v3'),
+    ])
+
+
+@pytest.mark.parametrize('text, token', [
+    ("alternativas para invertir en ETH", 'ETH'),
+    ("dame alternativas en arb", 'ARB'),
+    ("show me alternatives on OP", 'OP'),
+])
+def test_ticker_after_preposition_is_a_token(store, text, token):
+    intent = parse_alternatives_request(text, store)
+    assert intent['token'] == token
+    assert intent['chain'] is None
+    assert not intent['ambiguous']
+
+
+def test_full_chain_name_is_a_chain(store):
+    intent = parse_alternatives_request("alternativas para USDC en arbitrum", store)
+    assert intent['token'] == 'USDC'
+    assert intent['chain'] == 'Arbitrum'
+
+
+def test_protocol_scope(store):
+    intent = parse_alternatives_request("alternativas para USDC en aave", store)
+    assert intent['token'] == 'USDC'
+    assert intent['protocol'] == 'aave'
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from db import LazyEngine
+from metrics import increment, span
+from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, and_, delete, func, select
+
+# Base de datos SQLite con el histórico de APY/TVL por pool (vacío = desactivado)
+YIELD_HISTORY_URL = os.environ.get("YIELD_HISTORY_URL", "sqlite:///.yield_history.sqlite")
+# Cambio mínimo de APY (puntos porcentuales) para guardar un nuevo punto de un pool
+YIELD_HISTORY_APY_EPSILON = float(os.environ.get("YIELD_HISTORY_APY_EPSILON", 0.01))
+# Cambio relativo mínimo de TVL para guardar un nuevo punto de un pool
+YIELD_HISTORY_TVL_CHANGE = float(os.environ.get("YIELD_HISTORY_TVL_CHANGE", 0.01))
+# Días de histórico que se conservan (más el último punto anterior de cada pool)
+YIELD_HISTORY_RETENTION_DAYS = float(os.environ.get("YIELD_HISTORY_RETENTION_DAYS", 90))
+# Coeficiente de variación máximo del APY a 30 días para considerar un pool estable
+YIELD_STABLE_MAX_CV = float(os.environ.get("YIELD_STABLE_MAX_CV", 0.25))
+# Ventanas (días) de las estadísticas por pool
+STATS_WINDOWS = (7, 30)
+
+DAY = 24 * 3600
+
+_metadata = MetaData()
+# Sólo se guarda un punto cuando el pool cambia: cada fila es el valor del pool
+# desde `ts` hasta la siguiente fila del mismo pool (función escalonada).
+# Clave (pool, ts) sin rowid: las filas de cada pool quedan contiguas y
+# ordenadas por tiempo.
+pool_yields = Table(
+    "pool_yields",
+    _metadata,
+    Column("pool", String(64), primary_key=True),
+    Column("ts", Float, primary_key=True),
+    Column("apy", Float, nullable=False),
+    Column("tvl", Float, nullable=False),
+    Index("ix_pool_yields_ts", "ts"),
+    sqlite_with_rowid=False,
+)
+yield_snapshots = Table(
+    "yield_snapshots",
+    _metadata,
+    Column("ts", Float, primary_key=True),
+    Column("pools", Integer, nullable=False),
+    Column("changed", Integer, nullable=False),
+)
+
+
+class YieldHistory:
+    """
+    Histórico local de APY/TVL por pool de DeFiLlama. Cada snapshot se compara
+    con el último valor conocido de cada pool y sólo se añaden los pools que
+    han cambiado (o son nuevos). Las tendencias y estadísticas a 7/30 días se
+    leen por rango del índice (pool, ts), sin recorrer el histórico completo.
+    """
+
+    def __init__(self, url=YIELD_HISTORY_URL, apy_epsilon=YIELD_HISTORY_APY_EPSILON,
+                 tvl_change=YIELD_HISTORY_TVL_CHANGE, retention_days=YIELD_HISTORY_RETENTION_DAYS):
+        self.url = url
+        self.apy_epsilon = apy_epsilon
+        self.tvl_change = tvl_change
+        self.retention_days = retention_days
+        self._db = LazyEngine(url, _metadata)
+        # Serializa las ingestas (el diff depende del último estado guardado)
+        self._lock = threading.Lock()
+        # Último valor guardado de cada pool (índice: id del pool) y del snapshot
+        self._last = None
+        self._last_ts = None
+        self._pruned_at = 0.0
+
+    @property
+    def engine(self):
+        return self._db.get()
+
+    def _load_last(self, conn):
+        """Último punto de cada pool y fecha del último snapshot ingerido. Requiere _lock."""
+        latest = (
+            select(pool_yields.c.pool, func.max(pool_yields.c.ts).label("ts"))
+            .group_by(pool_yields.c.pool)
+            .subquery()
+        )
+        rows = conn.execute(
+            select(pool_yields.c.pool, pool_yields.c.apy, pool_yields.c.tvl)
+            .join(latest, and_(pool_yields.c.pool == latest.c.pool, pool_yields.c.ts == latest.c.ts))
+        ).all()
+        self._last = pd.DataFrame(rows, columns=["pool", "apy", "tvl"]).set_index("pool")
+        self._last_ts = conn.execute(select(func.max(yield_snapshots.c.ts))).scalar() or 0.0
+
+    def record(self, store):
+        """
+        Ingiere un snapshot (PoolStore): guarda sólo los pools nuevos o con
+        cambios de APY/TVL por encima de los umbrales. Los snapshots ya
+        ingeridos (misma fecha o anterior) se ignoran. Devuelve los pools guardados.
+        """
+        with self._lock, span("yield_history.record"):
+            current = pd.DataFrame(
+                {"apy": store.column("apy"), "tvl": store.column("tvlUsd")},
+                index=pd.Index(store.column("pool"), name="pool"),
+            )
+            current = current[current.index != ""]
+            current = current[~current.index.duplicated()]
+
+            with self.engine.begin() as conn:
+                if self._last is None:
+                    self._load_last(conn)
+                if store.fetched_at <= self._last_ts:
+                    return 0
+
+                joined = current.join(self._last, rsuffix="_prev")
+                changed = (
+                    joined["apy_prev"].isna()
+                    | ((joined["apy"] - joined["apy_prev"]).abs() >= self.apy_epsilon)
+                    | ((joined["tvl"] - joined["tvl_prev"]).abs() > self.tvl_change * joined["tvl_prev"].abs().clip(lower=1.0))
+                )
+                rows = current[changed.to_numpy()]
+                if len(rows):
+                    conn.execute(pool_yields.insert(), [
+                        {"pool": pool, "ts": store.fetched_at, "apy": apy, "tvl": tvl}
+                        for pool, apy, tvl in zip(rows.index, rows["apy"].tolist(), rows["tvl"].tolist())
+                    ])
+                conn.execute(yield_snapshots.insert().values(ts=store.fetched_at, pools=len(current), changed=len(rows)))
+                if store.fetched_at - self._pruned_at > DAY:
+                    self._prune(conn, store.fetched_at)
+
+            self._last = rows.combine_first(self._last) if len(self._last) else rows
+            self._last_ts = store.fetched_at
+            increment("yield_history.snapshots")
+            increment("yield_history.changed_pools", len(rows))
+            return len(rows)
+
+    def _prune(self, conn, now):
+        """Borra los puntos fuera de la retención salvo el último de cada pool (base de las ventanas)."""
+        cutoff = now - self.retention_days * DAY
+        older = pool_yields.alias("older")
+        newest_before_cutoff = (
+            select(func.max(older.c.ts))
+            .where(older.c.pool == pool_yields.c.pool, older.c.ts < cutoff)
+            .scalar_subquery()
+        )
+        conn.execute(delete(pool_yields).where(pool_yields.c.ts < cutoff, pool_yields.c.ts < newest_before_cutoff))
+        conn.execute(delete(yield_snapshots).where(yield_snapshots.c.ts < cutoff))
+        self._pruned_at = now
+
+    def _points(self, pool_ids, since):
+        """
+        Puntos de los pools desde `since`, más el último anterior de cada uno
+        (el valor vigente al empezar la ventana). DataFrame ordenado por pool y ts.
+        """
+        ids = list(pool_ids)
+        with self.engine.connect() as conn:
+            baseline = (
+                select(pool_yields.c.pool, func.max(pool_yields.c.ts).label("ts"))
+                .where(pool_yields.c.pool.in_(ids), pool_yields.c.ts < since)
+                .group_by(pool_yields.c.pool)
+                .subquery()
+            )
+            columns = (pool_yields.c.pool, pool_yields.c.ts, pool_yields.c.apy, pool_yields.c.tvl)
+            before = conn.execute(
+                select(*columns).join(baseline, and_(pool_yields.c.pool == baseline.c.pool, pool_yields.c.ts == baseline.c.ts))
+            ).all()
+            within = conn.execute(
+                select(*columns).where(pool_yields.c.pool.in_(ids), pool_yields.c.ts >= since)
+            ).all()
+        points = pd.DataFrame(before + within, columns=["pool", "ts", "apy", "tvl"])
+        return points.sort_values(["pool", "ts"], kind="stable", ignore_index=True)
+
+    def history(self, pool_id, days=30):
+        """Serie (ts, apy, tvl) de un pool en los últimos `days` días, con el valor vigente al inicio."""
+        points = self._points([pool_id], time.time() - days * DAY)
+        return points.drop(columns="pool")
+
+    def stats(self, pool_ids, windows=STATS_WINDOWS, now=None):
+        """
+        Estadísticas del APY por pool y ventana, ponderadas por tiempo (la serie
+        es escalonada): {pool: {'apy_mean_7d', 'apy_std_7d', 'apy_min_7d',
+        'apy_max_7d', 'apy_change_7d', 'coverage_7d', ...}}. coverage es la
+        fracción de la ventana cubierta por el histórico; los pools sin
+        histórico no aparecen.
+        """
+        ids = {pool for pool in pool_ids if pool}
+        if not ids:
+            return {}
+        now = time.time() if now is None else now
+        points = self._points(ids, now - max(windows) * DAY)
+        result = {}
+        for pool, group in points.groupby("pool", sort=False):
+            ts = group["ts"].to_numpy()
+            apy = group["apy"].to_numpy()
+            stats = {}
+            for days in windows:
+                start = now - days * DAY
+                # Cada punto vale desde max(ts, start) hasta el siguiente punto (o ahora)
+                begins = np.maximum(ts, start)
+                ends = np.append(ts[1:], now)
+                durations = np.clip(ends - begins, 0, None)
+                mask = durations > 0
+                if not mask.any():
+                    continue
+                weights, values = durations[mask], apy[mask]
+                mean = float(np.average(values, weights=weights))
+                stats[f"apy_mean_{days}d"] = mean
+                stats[f"apy_std_{days}d"] = float(np.sqrt(np.average((values - mean) ** 2, weights=weights)))
+                stats[f"apy_min_{days}d"] = float(values.min())
+                stats[f"apy_max_{days}d"] = float(values.max())
+                stats[f"apy_change_{days}d"] = float(apy[-1] - values[0])
+                stats[f"coverage_{days}d"] = float(min(weights.sum() / (days * DAY), 1.0))
+            if stats:
+                result[pool] = stats
+        return result
+
+    def clear(self):
+        with self._lock:
+            with self.engine.begin() as conn:
+                conn.execute(delete(pool_yields))
+                conn.execute(delete(yield_snapshots))
+            self._last = None
+            self._last_ts = None
+
+
+yield_history = YieldHistory()
+
+
+def record_snapshot(store):
+    """Ingiere un snapshot en el histórico; los fallos del histórico nunca afectan a la app."""
+    if not YIELD_HISTORY_URL:
+        return None
+    try:
+        return yield_history.record(store)
+    except Exception:
+        increment("yield_history.errors")
+        return None
+
+
+def get_pool_stats(pool_ids, windows=STATS_WINDOWS):
+    """yield_history.stats, o {} si el histórico no está disponible."""
+    if not YIELD_HISTORY_URL:
+        return {}
+    try:
+        return yield_history.stats(pool_ids, windows=windows)
+    except Exception:
+        increment("yield_history.errors")
+        return {}
+
+
+def is_stable(stats, days=30, max_cv=YIELD_STABLE_MAX_CV):
+    """
+    True/False según la variación del APY en la ventana (desviación y cambio
+    respecto a la media, para no dar por estable un salto reciente), o None si
+    no hay histórico.
+    """
+    if not stats or f"apy_mean_{days}d" not in stats:
+        return None
+    mean = stats[f"apy_mean_{days}d"]
+    spread = max(stats[f"apy_std_{days}d"], abs(stats[f"apy_change_{days}d"]))
+    if mean <= 0:
+        return spread == 0
+    return spread / mean <= max_cv
+
+
+def describe_trend(stats):
+    """Texto breve con la evolución del APY de un pool (para prompts y la UI), o ''."""
+    if not stats:
+        return ""
+    parts = []
+    for days in STATS_WINDOWS:
+        if f"apy_mean_{days}d" not in stats:
+            continue
+        text = (f"{days}d: media {stats[f'apy_mean_{days}d']:.2f}%, "
+                f"cambio {stats[f'apy_change_{days}d']:+.2f} pp, "
+                f"rango {stats[f'apy_min_{days}d']:.2f}-{stats[f'apy_max_{days}d']:.2f}%")
+        if stats[f"coverage_{days}d"] < 0.9:
+            text += f" (histórico de {stats[f'coverage_{days}d'] * days:.0f} días)"
+        parts.append(text)
+    return "; ".join(parts)
+
+
+def annotate_with_trends(records):
+    """
+    Añade a cada alternativa (dict con 'pool') la media y el cambio del APY a
+    7 y 30 días y si es estable. Sin histórico los campos quedan en None.
+    """
+    stats = get_pool_stats(record.get("pool") for record in records)
+    annotated = []
+    for record in records:
+        pool_stats = stats.get(record.get("pool"))
+        annotated.append({
+            **record,
+            **{f"apy_{kind}_{days}d": (pool_stats or {}).get(f"apy_{kind}_{days}d")
+               for days in STATS_WINDOWS for kind in ("mean", "change")},
+            "apy_stable": is_stable(pool_stats),
+            "apy_trend": describe_trend(pool_stats),
+        })
+    return annotated
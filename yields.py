@@ -0,0 +1,270 @@
+import os
+import threading
+import time
+from http_client import HTTP_TIMEOUT, http_get
+from metrics import increment, timed
+from pool_store import PoolStore
+
+LLAMA_YIELDS_URL = os.environ.get("LLAMA_YIELDS_URL", "https://yields.llama.fi/pools")
+# Segundos que un snapshot de DeFiLlama se considera fresco (configurable por entorno)
+LLAMA_YIELDS_TTL = float(os.environ.get("LLAMA_YIELDS_TTL", 600))
+# Directorio donde se guarda el último snapshot válido (arranque en frío y modo offline)
+LLAMA_SNAPSHOT_DIR = os.environ.get("LLAMA_SNAPSHOT_DIR", ".yields_snapshot")
+
+def _fetch_defi_llama_yields(validators=None):
+    """
+    Descarga el listado completo de pools de DeFiLlama.
+    La respuesta (comprimida) se lee por trozos y sólo se conservan los campos
+    que usa la app, en un PoolStore columnar: {'status': 'success', 'data': PoolStore}.
+    Con los validadores del snapshot actual la petición es condicional y, si
+    DeFiLlama no ha cambiado, devuelve {'status': 'not_modified'} sin cuerpo.
+    """
+    result = http_get(LLAMA_YIELDS_URL, "defillama.yields", timeout=(HTTP_TIMEOUT[0], 120),
+                      validators=validators, parse=PoolStore.from_stream)
+    if result.get("status") == "success":
+        result["data"].validators = result.pop("validators")
+    return result
+
+def _record_history(store):
+    # SQLAlchemy sólo se carga cuando hay un snapshot que guardar
+    from yield_history import record_snapshot
+    record_snapshot(store)
+
+class YieldsCache:
+    """
+    Snapshot de pools de DeFiLlama compartido por todas las sesiones del proceso.
+    Sirve el último snapshot válido aunque esté caducado (stale-while-revalidate)
+    y lo refresca en un hilo en segundo plano, de modo que sólo la primera
+    petición del proceso espera a la descarga.
+    """
+
+    def __init__(self, fetcher=_fetch_defi_llama_yields, ttl=LLAMA_YIELDS_TTL, snapshot_dir=LLAMA_SNAPSHOT_DIR):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self.source = None
+        self.version = 0
+        self.fetched_at = 0.0
+        self.last_error = None
+        self._data = None
+        self.store = None
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._worker = None
+
+    def _download(self):
+        """
+        Descarga un snapshot nuevo; si falla (también si el fetcher o la
+        construcción del store lanzan una excepción) se conserva el anterior y
+        se anota el error. Requiere _fetch_lock.
+        """
+        try:
+            with self._lock:
+                validators = self.store.validators if self.store is not None else None
+            try:
+                result = self.fetcher(validators=validators)
+                not_modified = isinstance(result, dict) and result.get('status') == 'not_modified'
+                ok = not not_modified and isinstance(result, dict) and 'error' not in result
+                # El store columnar se construye aquí, fuera del camino de las peticiones
+                # (si el fetcher ya devuelve un PoolStore se reutiliza tal cual)
+                store = PoolStore.from_llama(result) if ok else None
+            except Exception as e:
+                result = {"error": f"Exception occurred: {str(e)}"}
+                not_modified = ok = False
+            with self._lock:
+                if not_modified:
+                    # Sin cambios en DeFiLlama: el snapshot actual vuelve a estar fresco
+                    self.fetched_at = self.store.fetched_at = time.time()
+                    self.last_error = None
+                    self.source = "network"
+                elif ok:
+                    self._data = result
+                    self.store = store
+                    self.fetched_at = store.fetched_at
+                    self.version += 1
+                    self.last_error = None
+                    self.source = "network"
+                else:
+                    self.last_error = result.get('error') if isinstance(result, dict) else str(result)
+        finally:
+            # Siempre se libera la marca: si no, nadie volvería a refrescar
+            with self._lock:
+                self._refreshing = False
+        if not_modified:
+            return self._data
+        if ok and self.snapshot_dir:
+            try:
+                store.save(self.snapshot_dir)
+            except Exception:
+                pass
+        if ok:
+            # Los cambios respecto al snapshot anterior van al histórico, fuera
+            # del camino de la petición
+            threading.Thread(target=_record_history, args=(store,), name="yield-history", daemon=True).start()
+        return result
+
+    def _load_from_disk(self):
+        """Carga (mmap) el último snapshot guardado en disco. Requiere _fetch_lock."""
+        if not self.snapshot_dir:
+            return False
+        store = PoolStore.load(self.snapshot_dir)
+        if store is None:
+            return False
+        with self._lock:
+            if self._data is None:
+                self._data = {"status": "success", "data": store}
+                self.store = store
+                self.fetched_at = store.fetched_at
+                self.version += 1
+                self.source = "disk"
+        return True
+
+    def _refresh(self):
+        with self._fetch_lock:
+            return self._download()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(max(self.ttl, 1))
+            with self._lock:
+                if self._refreshing:
+                    continue
+                self._refreshing = True
+            self._refresh()
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._refresh_loop, name="defillama-yields-refresh", daemon=True)
+            self._worker.start()
+
+    def is_stale(self):
+        return self._data is None or time.time() - self.fetched_at > self.ttl
+
+    def get(self, force_refresh=False):
+        """
+        Devuelve el snapshot actual ({'data': [...]}) o un dict con 'error'
+        si todavía no se ha podido descargar ninguno.
+        """
+        with self._lock:
+            data = self._data
+            trigger = data is not None and (force_refresh or self.is_stale()) and not self._refreshing
+            if trigger:
+                self._refreshing = True
+        if trigger:
+            threading.Thread(target=self._refresh, name="defillama-yields-revalidate", daemon=True).start()
+        if data is not None:
+            increment("defillama.yields.cache_hit")
+            self._start_worker()
+            return data
+
+        # Arranque en frío: primero el snapshot en disco (aunque esté caducado, se
+        # revalida en segundo plano); si no existe, una sola descarga para todas
+        # las sesiones que llegan a la vez
+        with self._fetch_lock:
+            result = self._data
+            if result is None and self._load_from_disk():
+                result = self._data
+                with self._lock:
+                    self._refreshing = self.is_stale()
+                if self._refreshing:
+                    threading.Thread(target=self._refresh, name="defillama-yields-revalidate", daemon=True).start()
+            elif result is None:
+                result = self._download()
+        if self._data is not None:
+            self._start_worker()
+            return self._data
+        return result
+
+    def status(self):
+        """Estado del snapshot para mostrar en la UI (edad, origen, modo offline)."""
+        with self._lock:
+            has_data = self._data is not None
+            return {
+                "version": self.version,
+                "fetched_at": self.fetched_at if has_data else None,
+                "age_seconds": time.time() - self.fetched_at if has_data else None,
+                "source": self.source,
+                "last_error": self.last_error,
+                # Sirviendo datos caducados porque DeFiLlama no responde
+                "offline": has_data and self.last_error is not None and self.is_stale(),
+            }
+
+_yields_cache = YieldsCache()
+
+def get_defi_llama_yields(force_refresh=False):
+    """
+    Consulta pools de https://yields.llama.fi/pools a través del snapshot
+    compartido del proceso (ver YieldsCache).
+    """
+    return _yields_cache.get(force_refresh=force_refresh)
+
+def get_yields_status():
+    """Estado del snapshot compartido de DeFiLlama (ver YieldsCache.status)."""
+    return _yields_cache.status()
+
+def yields_offline_notice():
+    """Mensaje para la UI cuando se sirven datos de DeFiLlama sin conexión, o None."""
+    status = get_yields_status()
+    if not status["offline"]:
+        return None
+    fetched = time.strftime("%Y-%m-%d %H:%M", time.localtime(status["fetched_at"]))
+    return f"DeFiLlama no responde: mostrando el último snapshot disponible ({fetched})."
+
+_adhoc_store = (None, None)
+
+def get_pool_store(llama_data=None):
+    """
+    Devuelve el PoolStore columnar del snapshot dado. Para el snapshot compartido
+    se reutiliza el store ya construido; para otros datos se memoriza el último.
+    """
+    global _adhoc_store
+    if llama_data is None:
+        llama_data = get_defi_llama_yields()
+    if llama_data is _yields_cache._data and _yields_cache.store is not None:
+        return _yields_cache.store
+    if isinstance(llama_data, dict) and isinstance(llama_data.get('data'), PoolStore):
+        return llama_data['data']
+    data, store = _adhoc_store
+    if data is not llama_data:
+        store = PoolStore.from_llama(llama_data)
+        _adhoc_store = (llama_data, store)
+    return store
+
+ALTERNATIVE_FIELDS = ['pool', 'symbol', 'project', 'chain', 'apy', 'tvlUsd']
+
+@timed("get_alternatives_for_token")
+def get_alternatives_for_token(token_symbol, llama_data, n=3, chain=None, protocol=None):
+    """
+    Dado un token_symbol y la data de DeFi Llama,
+    encuentra pools con APY altos que contengan ese token.
+    Opcionalmente restringe a una blockchain y/o protocolo.
+    """
+    if not llama_data or 'data' not in llama_data:
+        return []
+    store = get_pool_store(llama_data)
+    if not chain and not protocol:
+        # Pools que contienen alguno de los tokens de la posición (índice invertido)
+        top = store.top_alternatives([token_symbol], n)[token_symbol]
+        return store.records(top, fields=ALTERNATIVE_FIELDS)
+    rows = store.token_index.lookup(token_symbol, match_all=False)
+    if chain:
+        rows = rows[store.chain_mask(chain)[rows]]
+    if protocol:
+        rows = rows[store.project_mask(protocol)[rows]]
+    return store.records(store.top_by_apy(rows, n), fields=ALTERNATIVE_FIELDS)
+
+@timed("get_alternatives_for_portfolio")
+def get_alternatives_for_portfolio(df, llama_data, n=3):
+    """
+    Versión por lotes de get_alternatives_for_token para todo el portafolio.
+    Devuelve {índice de fila de df: lista de alternativas}; cada token distinto
+    se resuelve una única vez.
+    """
+    if df is None or df.empty or not llama_data or 'data' not in llama_data:
+        return {}
+    store = get_pool_store(llama_data)
+    symbols = df['token_symbol'].astype(str)
+    top_by_symbol = store.top_alternatives(symbols.unique(), n)
+    records_by_symbol = {symbol: store.records(top, fields=ALTERNATIVE_FIELDS) for symbol, top in top_by_symbol.items()}
+    return {idx: records_by_symbol[symbol] for idx, symbol in symbols.items()}